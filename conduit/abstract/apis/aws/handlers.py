@@ -1,21 +1,48 @@
 import concurrent.futures
 import logging
+import math
 import os
 import queue
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
 
 from botocore.exceptions import ClientError
 
 from .services import AWSClientFactory
-from .types import FileMetaData, FileObject
+from .types import FileMetaData, FileObject, MultipartFileObject
 
 bucket = os.getenv("AWS_BUCKET_NAME")
 logger = logging.getLogger("abstract")
 
+# bytes read from S3 at a time when an object is streamed through the app
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# keys per DeleteObjects request, the most S3 accepts
+DELETE_BATCH_SIZE = 1000
+# files above this many bytes are uploaded in parts
+MULTIPART_THRESHOLD = 100 * 1024 * 1024
+# parts start at MIN_PART_SIZE and double until a file needs at most
+# TARGET_PART_COUNT of them (S3 allows 10,000 parts of 5 MiB to 5 GiB)
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+TARGET_PART_COUNT = 1000
+
+
+def get_part_size(filesize: int) -> int:
+    """Bytes per part for a file of `filesize` bytes: small files keep small
+    parts (cheap to retry), big ones grow them to bound the part count"""
+
+    part_size = MIN_PART_SIZE
+    while math.ceil(filesize / part_size) > TARGET_PART_COUNT:
+        if part_size * 2 > MAX_PART_SIZE:
+            return MAX_PART_SIZE
+        part_size *= 2
+
+    return part_size
+
 
 class S3AWSHandler:
     def __init__(self) -> None:
-        self.client = AWSClientFactory.build_client("s3")
+        self.client = AWSClientFactory.get_client("s3")
         self.queue = queue.Queue()
 
     def create_folder(self, path: str) -> None:
@@ -24,6 +51,40 @@ class S3AWSHandler:
         except Exception as e:
             logger.exception(f"Error creating folder -> {str(e)}")
 
+    def delete_objects(self, keys: List[str]) -> List[str]:
+        """Delete keys with one DeleteObjects request per DELETE_BATCH_SIZE.
+
+        Returns the keys S3 could not delete.
+        """
+
+        failed: List[str] = []
+        for i in range(0, len(keys), DELETE_BATCH_SIZE):
+            response = self.client.delete_objects(
+                Bucket=bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": key} for key in keys[i : i + DELETE_BATCH_SIZE]
+                    ],
+                    "Quiet": True,
+                },
+            )
+            for error in response.get("Errors", []):
+                logger.error(f"Error deleting {error['Key']} -> {error['Message']}")
+                failed.append(error["Key"])
+
+        return failed
+
+    def get_object_metadata(self, key: str) -> Dict[str, str]:
+        """The user metadata an object was uploaded with"""
+
+        return self.client.head_object(Bucket=bucket, Key=key).get("Metadata", {})
+
+    def iter_object_chunks(self, key: str) -> Iterator[bytes]:
+        """Read an object's body a chunk at a time instead of all at once"""
+
+        response = self.client.get_object(Bucket=bucket, Key=key)
+        yield from response["Body"].iter_chunks(DOWNLOAD_CHUNK_SIZE)
+
     def _get_upload_presigned_url(
         self, key: str, metadata: Optional[FileMetaData] = None
     ) -> str:
@@ -57,6 +118,13 @@ class S3AWSHandler:
 
         return self._get_download_presigned_url(path)
 
+    def get_download_presigned_urls(self, paths: List[str]) -> List[str]:
+        """Sign a batch of keys with the shared client, returned in the same
+        order. Signing is local CPU work (no request is sent), so nothing
+        is gained by spreading it over a pool."""
+
+        return [self._get_download_presigned_url(path) for path in paths]
+
     def get_upload_presigned_url(
         self,
         file_obj: FileObject,
@@ -76,6 +144,81 @@ class S3AWSHandler:
 
         self.queue.put(file_obj)
 
+    def create_multipart_upload(
+        self,
+        file_obj: FileObject,
+        root: str = None,
+        metadata: Optional[FileMetaData] = None,
+    ) -> MultipartFileObject:
+        """Start a multipart upload for a large file; its parts are signed
+        separately with `get_upload_part_presigned_urls`"""
+
+        full_path = file_obj["path"] if not root else root + file_obj["path"]
+        upload = self.client.create_multipart_upload(
+            Bucket=bucket, Key=full_path, Metadata=metadata
+        )
+
+        part_size = get_part_size(file_obj["filesize"])
+        return MultipartFileObject(
+            **file_obj,
+            url="",
+            upload_id=upload["UploadId"],
+            part_size=part_size,
+            part_count=max(1, math.ceil(file_obj["filesize"] / part_size)),
+        )
+
+    def get_upload_part_presigned_urls(
+        self, key: str, upload_id: str, part_numbers: Iterable[int]
+    ) -> List[str]:
+
+        return [
+            self.client.generate_presigned_url(
+                ClientMethod="upload_part",
+                Params={
+                    "Bucket": bucket,
+                    "Key": key,
+                    "UploadId": upload_id,
+                    "PartNumber": part_number,
+                },
+                ExpiresIn=1000,
+            )
+            for part_number in part_numbers
+        ]
+
+    def complete_multipart_upload(
+        self, key: str, upload_id: str, parts: List[Dict[str, object]]
+    ) -> None:
+        """Assemble the uploaded parts, given as PartNumber / ETag pairs"""
+
+        self.client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])},
+        )
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+
+        self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+
+    def abort_multipart_uploads(self, initiated_before: datetime) -> int:
+        """Abort every multipart upload started before `initiated_before`,
+        freeing the parts S3 keeps (and bills) for them; returns the count"""
+
+        aborted = 0
+        paginator = self.client.get_paginator("list_multipart_uploads")
+        for page in paginator.paginate(Bucket=bucket):
+            for upload in page.get("Uploads", []):
+                if upload["Initiated"] >= initiated_before:
+                    continue
+                try:
+                    self.abort_multipart_upload(upload["Key"], upload["UploadId"])
+                    aborted += 1
+                except ClientError as e:
+                    logger.error(f"Error aborting upload {upload['Key']} -> {str(e)}")
+
+        return aborted
+
     def fetch_urls(
         self,
         file_objects: List[FileObject],
@@ -87,9 +230,9 @@ class S3AWSHandler:
         if len(file_objects) > 10:
             with concurrent.futures.ThreadPoolExecutor(
                 max_workers=min(32, len(file_objects) // 2)
-            ) as exec:
+            ) as executor:
                 futures = [
-                    exec.submit(self.get_upload_presigned_url, file, root, metadata)
+                    executor.submit(self.get_upload_presigned_url, file, root, metadata)
                     for file in file_objects
                 ]
 
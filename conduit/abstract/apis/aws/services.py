@@ -1,5 +1,5 @@
 import os
-from functools import partial
+from functools import lru_cache, partial
 
 import boto3
 from botocore.config import Config
@@ -17,7 +17,11 @@ class AWSClientFactory(object):
         )
 
         if service == "s3":
-            return service_client(config=Config(signature_version="s3v4"))
+            return service_client(
+                config=Config(signature_version="s3v4"),
+                # point at a local stand-in (moto, minio...) when set
+                endpoint_url=os.getenv("AWS_S3_ENDPOINT_URL"),
+            )
         else:
             return service_client()
 
@@ -27,3 +31,9 @@ class AWSClientFactory(object):
         #     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
         #     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
         # )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_client(service: str):
+        """Shared client for the process, so credentials are resolved once"""
+        return AWSClientFactory.build_client(service)
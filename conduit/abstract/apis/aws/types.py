@@ -13,6 +13,13 @@ class FileObject(BaseFileObject):
     size: int
 
 
+class MultipartFileObject(FileObject):
+    # a large file, uploaded in `part_count` parts of `part_size` bytes
+    upload_id: str
+    part_size: int
+    part_count: int
+
+
 class FileMetaData(TypedDict):
 
     author: str
@@ -0,0 +1,54 @@
+import os
+import time
+from typing import List
+
+from abstract.apis.aws.handlers import S3AWSHandler, bucket
+from abstract.apis.aws.services import AWSClientFactory
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+
+class Command(BaseCommand):
+    help = "Measure presigned download URLs per second for batches of keys"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--keys",
+            nargs="+",
+            type=int,
+            default=[1000, 10000, 100000],
+            help="Batch sizes to sign",
+        )
+
+    def handle(self, *args, **options) -> None:
+
+        if not bucket:
+            raise CommandError("AWS_BUCKET_NAME must be set")
+
+        if os.getenv("AWS_S3_ENDPOINT_URL"):
+            self.run(options["keys"])
+            return
+
+        # no stand-in configured: fall back to an in-process moto S3
+        from moto import mock_aws
+
+        with mock_aws():
+            AWSClientFactory.get_client.cache_clear()
+            AWSClientFactory.get_client("s3").create_bucket(Bucket=bucket)
+            self.run(options["keys"])
+
+        AWSClientFactory.get_client.cache_clear()
+
+    def run(self, batches: List[int]) -> None:
+
+        handler = S3AWSHandler()
+        self.stdout.write(f"{'keys':>8} {'seconds':>9} {'urls/s':>10}")
+
+        for count in batches:
+            paths = [f"bench-drive/folder/file-{i}.txt" for i in range(count)]
+
+            start = time.perf_counter()
+            urls = handler.get_download_presigned_urls(paths)
+            elapsed = time.perf_counter() - start
+
+            assert len(urls) == count and all(urls)
+            self.stdout.write(f"{count:>8} {elapsed:>9.2f} {count / elapsed:>10.0f}")
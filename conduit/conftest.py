@@ -1,10 +1,15 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
+from unittest.mock import patch
 
 import pytest
+from abstract.apis.aws.handlers import S3AWSHandler
+from abstract.apis.aws.services import AWSClientFactory
 from django.contrib.auth.models import AbstractBaseUser
+from django.core.cache import cache
+from moto import mock_aws
 from pytest_factoryboy import register
 from rest_framework.test import APIClient
-from storage.models import Object
+from storage.models import Drive, Object
 from storage.tests.factory import DriveFactory, ObjectFactory
 from users.tests.factory import OTPFactory, UserFactory
 
@@ -30,6 +35,52 @@ def tokens(conduit_user: Optional[AbstractBaseUser] = None) -> Dict[str, Any]:
     return {"user": conduit_user, "tokens": response_data["token"]}
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Tests never see what an earlier one cached"""
+
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture(scope="function")
+def drive(drive_factory, user_factory) -> Drive:
+
+    return drive_factory.create(owner=user_factory.create(), name="vault")
+
+
+@pytest.fixture(scope="function")
+def as_user() -> Callable[[AbstractBaseUser], APIClient]:
+    """Helper for an API client signed in as a given user"""
+
+    def login(user: AbstractBaseUser) -> APIClient:
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    return login
+
+
+@pytest.fixture(scope="function")
+def owner_client(drive: Drive, as_user) -> APIClient:
+
+    return as_user(drive.owner)
+
+
+@pytest.fixture(scope="function")
+def s3_handler() -> S3AWSHandler:
+    """S3 handler backed by an in-memory moto bucket"""
+
+    with mock_aws(), patch("abstract.apis.aws.handlers.bucket", "test-bucket"):
+        AWSClientFactory.get_client.cache_clear()
+        handler = S3AWSHandler()
+        handler.client.create_bucket(Bucket="test-bucket")
+        yield handler
+
+    AWSClientFactory.get_client.cache_clear()
+
+
 @pytest.fixture(scope="function")
 def tree_paths() -> List[str]:
 
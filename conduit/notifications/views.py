@@ -1,4 +1,3 @@
-from django.db import models
 from django.db.models import QuerySet
 from django.http import HttpRequest
 from django.shortcuts import HttpResponse
@@ -8,6 +7,7 @@ from rest_framework.mixins import ListModelMixin
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
+from storage.models import Drive
 
 from .models import DriveNotification
 from .serializers import NotificationSerializer, NotifUpdateSerializer
@@ -24,9 +24,8 @@ class DriveNotificationView(ListModelMixin, GenericViewSet):
         user = self.request.user
 
         notifications = self.queryset.filter(
-            models.Q(drive__members=self.request.user)
-            | models.Q(drive__owner=self.request.user)
-        ).distinct()
+            drive__in=Drive.objects.accessible_ids(user)
+        )
 
         notif_ids = user.read_notification.values_list("pk", flat=True)
         unread_notifications = notifications.exclude(uid__in=notif_ids)
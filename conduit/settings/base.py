@@ -122,6 +122,25 @@ REST_FRAMEWORK = {
     )
 }
 
+CELERY_BEAT_SCHEDULE = {
+    "verify-drive-usage": {
+        "task": "Verify Drive Usage",
+        "schedule": timedelta(hours=6),
+    },
+    "requeue-stranded-purges": {
+        "task": "Requeue Stranded Purges",
+        "schedule": timedelta(hours=1),
+    },
+    "finalize-stale-uploads": {
+        "task": "Finalize Stale Uploads",
+        "schedule": timedelta(hours=1),
+    },
+    "abort-abandoned-uploads": {
+        "task": "Abort Abandoned Uploads",
+        "schedule": timedelta(hours=6),
+    },
+}
+
 SIMPLE_JWT = {
     "USER_ID_FIELD": "uid",
     "ACCESS_TOKEN_LIFETIME": timedelta(hours=5),
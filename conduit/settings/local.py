@@ -24,7 +24,9 @@ CORS_ALLOW_HEADERS = (
     "X-CSRFToken",
     "x-csrftoken",
     "X-CSRFTOKEN",
+    "If-None-Match",
 )
+CORS_EXPOSE_HEADERS = ("ETag",)
 
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 DATABASES = {
@@ -158,7 +158,9 @@ if "corsheaders" in INSTALLED_APPS:  # noqa
         "X-CSRFToken",
         "x-csrftoken",
         "X-CSRFTOKEN",
+        "If-None-Match",
     )
+    CORS_EXPOSE_HEADERS = ("ETag",)
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
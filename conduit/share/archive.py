@@ -0,0 +1,60 @@
+import io
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+from abstract.apis.aws.handlers import S3AWSHandler
+from storage.models import Object
+
+
+class ArchiveStream(io.RawIOBase):
+    """Write-only, unseekable sink for ZipFile.
+
+    Whatever the archive writes is held until the next `drain()`, so memory
+    never grows past one S3 chunk plus the zip headers around it.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def get_archive_entries(asset: Object) -> Iterator[Tuple[str, str]]:
+    """(name in the archive, S3 key) for every file under the asset"""
+
+    if not asset.is_directory:
+        yield asset.name, asset.drive.name + asset.path
+        return
+
+    for rows in Object.objects.iter_subtree_files(asset):
+        for _, path, relative_path in rows:
+            yield relative_path, asset.drive.name + path
+
+
+def iter_archive(
+    entries: Iterable[Tuple[str, str]], handler: S3AWSHandler
+) -> Iterator[bytes]:
+    """Build a ZIP64 archive on the fly, streaming each S3 object into it"""
+
+    stream = ArchiveStream()
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, key in entries:
+            with archive.open(name, mode="w", force_zip64=True) as archive_file:
+                for chunk in handler.iter_object_chunks(key):
+                    archive_file.write(chunk)
+                    if stream.buffer:
+                        yield stream.drain()
+
+            yield stream.drain()
+
+    yield stream.drain()
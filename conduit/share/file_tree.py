@@ -1,135 +1,329 @@
 import logging
-
-# import time
-from typing import List, Optional
+from collections import defaultdict
+from functools import partial
+from typing import Dict, List, Optional, Set, Tuple, Union
+from uuid import UUID
 
 from abstract.apis.aws.types import FileMetaData
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser
 from django.db import IntegrityError, transaction
-from django.db.models import Sum
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from notifications.models import DriveNotification
-from share.models import Share
+from share.models import Share, UploadManifest
+from storage.cache import bump_drive_version
 from storage.models import Drive, Object
 
-
 User: AbstractBaseUser = get_user_model()
 logger = logging.getLogger("storage")
 
+Path = Tuple[str, ...]
 
-class FilePath:
-    def __init__(self, metadata: FileMetaData, db_conn_alias: str = "") -> None:
+# Times a tree is resolved again after losing a name to a concurrent writer.
+MATERIALIZE_ATTEMPTS = 3
 
-        self.metadata = metadata
 
-        self.tree: List[Object] = []
-        self.parent_path = ""
-        self.ids: List[str] = []
-        self.ids += metadata["file_path"].split("/")
-        self.leaf = self.ids[-1]
-        self.file_shared: Optional[Object] = None
+class FileTree:
+    """Ingests the uploaded files of one share together.
+
+    The file paths are merged into a trie first, so a folder shared by many
+    files is looked up or created once. The whole trie is resolved in one
+    query and its missing nodes inserted in one more (plus their `content`
+    links), however deep it goes; sizes are applied in a single UPDATE and
+    the share is finalized once.
+    """
+
+    def __init__(self, uploads: List[FileMetaData]) -> None:
+
+        self.metadata = uploads[0]
+        # the last upload of a path wins, as it does in the bucket
+        self.files: Dict[Path, int] = {
+            tuple(upload["file_path"].split("/")): int(upload["filesize"])
+            for upload in uploads
+        }
+        # bytes under every folder of the trie, what a new node starts with
+        self.totals: Dict[Path, int] = defaultdict(int)
+        for path, size in self.files.items():
+            for level in range(1, len(path) + 1):
+                self.totals[path[:level]] += size
+
+        self.nodes: Dict[Path, Object] = {}
+        self.created: Set[Path] = set()
 
         self.drive: Optional[Drive] = None
         self.author: Optional[AbstractBaseUser] = None
+        self.resource: Optional[Object] = None
 
     @transaction.atomic
-    def parse_path(self):
-        try:
-            self.drive = Drive.objects.select_for_update().get(
-                pk=self.metadata["drive_id"]
+    def ingest(self) -> List[Object]:
+        """Materialize every path; returns the top level objects shared.
+
+        Nothing drive-wide is locked. Resolving takes no lock on existing
+        folders; only the names this tree is about to create are locked.
+        Growing the sizes of existing folders does lock their rows until
+        commit, though, so uploads into the same folder still take turns,
+        while uploads into separate folders run alongside. The drive usage
+        moves by an atomic delta after commit. Any error rolls the whole
+        tree back and is raised to the caller.
+        """
+
+        self.drive = Drive.objects.get(pk=self.metadata["drive_id"])
+        self.author = User.objects.get(uid=self.metadata["author"])
+
+        # set root if a resource exists
+        if self.metadata.get("resource_id"):
+            self.resource = Object.objects.get(
+                pk=self.metadata.get("resource_id"), drive=self.drive
             )
-            self.author = User.objects.get(uid=self.metadata["author"])
 
-            # set root if a resource exists
-            if self.metadata.get("resource_id"):
-                parent = Object.objects.select_for_update().get(
-                    pk=self.metadata.get("resource_id"), drive=self.drive
-                )
-                self.parent_path = parent.path
-                self.tree.append(parent)
-
-            for obj in self.ids:
-
-                size = int(self.metadata["filesize"])
-                args = {
-                    "owner": self.author,
-                    "drive": self.drive,
-                    "name": obj,
-                }
-                args["path"] = (
-                    f"{self.tree[-1].path}/{obj}"
-                    if self.tree
-                    else f"{self.parent_path}/{obj}"
-                )
+        self.nodes = self.resolve()
+        Object.objects.lock_names(self.drive.pk, self.get_new_names())
 
-                if obj != self.leaf:
-                    args["is_directory"] = True
+        self.materialize()
 
-                if Object.objects.filter(**args).exists():
-                    file_object = Object.objects.prefetch_related(
-                        "content"
-                    ).get(**args)
-                    file_object.size += size
-                    file_object.save()
-                else:
-                    args["size"] = size
-                    file_object = Object.objects.create(**args)
+        total = self.apply_sizes()
+        transaction.on_commit(partial(self.drive.record_usage, total))
+        bump_drive_version(self.drive.pk)
 
-                if self.ids.index(obj) == 0:
-                    self.file_shared = file_object
+        self.track_manifest()
 
-                if self.tree and file_object not in self.tree[-1].content.all():
-                    self.tree[-1].content.add(file_object)
+        return self.get_shared_objects()
 
-                self.tree.append(file_object)
-                print(f"success: ops for {obj}", flush=True)
+    def get_parent(self, path: Path) -> Optional[Object]:
+        return self.nodes[path[:-1]] if len(path) > 1 else self.resource
 
-            transaction.on_commit(self.post_share_ops)
+    def resolve(self) -> Dict[Path, Object]:
+        return Object.objects.resolve_paths(
+            self.drive.pk, self.resource.pk if self.resource else None, self.totals
+        )
+
+    def get_new_names(self) -> Set[Tuple[Optional[UUID], str]]:
+        """(parent, name) of the topmost missing nodes; whatever goes below
+        them is only reachable through them"""
+
+        names = set()
+        for path in self.totals:
+            if path not in self.nodes and (len(path) == 1 or path[:-1] in self.nodes):
+                parent = self.get_parent(path)
+                names.add((parent.pk if parent else None, path[-1]))
+        return names
+
+    def materialize(self) -> None:
+        """Upsert every node of the trie in a constant number of queries.
+
+        Nodes are inserted with ON CONFLICT DO NOTHING; if a name was taken
+        since it was resolved (by a writer that does not lock paths), the
+        attempt is rolled back to its savepoint and resolved again.
+        """
+
+        for attempt in range(MATERIALIZE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return self.upsert_nodes()
+            except IntegrityError:
+                if attempt == MATERIALIZE_ATTEMPTS - 1:
+                    raise
+
+    def upsert_nodes(self) -> None:
+
+        # resolved again: what was missing may have been created while the
+        # names were being locked
+        self.nodes = self.resolve()
 
-        except (
-            IntegrityError,
-            Object.DoesNotExist,
-            User.DoesNotExist,
-            Drive.DoesNotExist,
-            Exception,
-        ) as e:
-            logger.error(
-                f'Error parsing file : {self.metadata["file_path"]}, {str(e)}'
+        # parents sort before their children, so each one is known in time
+        missing = sorted(
+            (path for path in self.totals if path not in self.nodes), key=len
+        )
+        for path in missing:
+            parent = self.get_parent(path)
+            self.nodes[path] = Object(
+                owner=self.author,
+                drive=self.drive,
+                parent=parent,
+                name=path[-1],
+                path=f"{parent.path if parent else ''}/{path[-1]}",
+                is_directory=path not in self.files,
+                size=self.totals[path],
+                ancestors=parent.ancestors + [parent.pk] if parent else [],
             )
-            return []
 
-    def post_share_ops(self):
+        new = [self.nodes[path] for path in missing]
+        Object.objects.bulk_create(new, ignore_conflicts=True)
+        if Object.objects.filter(pk__in=[obj.pk for obj in new]).count() < len(new):
+            raise IntegrityError("Objects were created concurrently, retrying")
 
-        args = {
-            "pk": self.metadata["share_uid"],
-            "drive": self.drive,
-            "author": self.author,
-            "note": self.metadata["note"],
-        }
+        Object.content.through.objects.bulk_create(
+            [
+                Object.content.through(
+                    from_object_id=obj.parent_id, to_object_id=obj.pk
+                )
+                for obj in new
+                if obj.parent_id
+            ],
+            ignore_conflicts=True,
+        )
+        self.created = set(missing)
 
-        if self.parent_path:
-            args["parent"] = self.tree[0]
+    def apply_sizes(self) -> float:
+        """Grow the nodes that already existed above a new file (resource
+        chain included) in one UPDATE; returns the total size added.
 
-        if Share.objects.filter(**args).exists():
+        A file uploaded again over an existing one moves itself and the
+        nodes above it by the difference in size. Its old size is read
+        under a row lock, so a concurrent upload of the same file waits.
+        """
 
-            share_obj = Share.objects.filter(**args).first()
-            share_obj.assets.add(self.file_shared.uid)
+        replaced = sorted(
+            self.nodes[path].pk
+            for path in self.files
+            if path not in self.created and not self.nodes[path].is_directory
+        )
+        previous = (
+            dict(
+                Object.objects.select_for_update()
+                .filter(pk__in=replaced)
+                .order_by("pk")
+                .values_list("pk", "size")
+            )
+            if replaced
+            else {}
+        )
+
+        deltas: Dict[UUID, float] = defaultdict(float)
+        total = 0.0
+        for path, size in self.files.items():
+            if path in self.created:
+                change = size
+            elif self.nodes[path].pk in previous:
+                change = size - (previous[self.nodes[path].pk] or 0)
+                deltas[self.nodes[path].pk] += change
+            else:
+                continue
+            total += change
+            for level in range(1, len(path)):
+                if path[:level] not in self.created:
+                    deltas[self.nodes[path[:level]].pk] += change
+
+        if self.resource:
+            for uid in self.resource.ancestors + [self.resource.pk]:
+                deltas[uid] += total
+
+        grown = [
+            Object(pk=uid, size=Coalesce(F("size"), 0.0) + delta)
+            for uid, delta in sorted(deltas.items())
+            if delta
+        ]
+        if grown:
+            Object.objects.bulk_update(grown, ["size"])
 
-        else:
-            share_obj = Share.objects.create(**args)
-            share_obj.assets.add(self.file_shared.uid)
+        return total
 
-        # calculate total drive usage
+    def get_shared_objects(self) -> List[Object]:
+        return list({self.nodes[path[:1]] for path in self.files})
 
-        usage = self.drive.storage_object.filter(
-            in_directory__isnull=True
-        ).aggregate(used_size=Sum("size"))
+    def track_manifest(self) -> None:
+        """Count this tree against the upload's manifest; uploads without
+        one (signed before manifests existed, or arriving after theirs
+        completed) are finalized on their own."""
 
-        self.drive.used = usage["used_size"]
-        self.drive.save()
+        shared = [obj.pk for obj in self.get_shared_objects()]
+        paths = ["/".join(path) for path in self.files]
+        if not advance_manifest(self.metadata["share_uid"], paths, shared):
+            transaction.on_commit(self.post_share_ops)
 
-        # notification ops here
+    def post_share_ops(self):
 
-        DriveNotification.objects.get_or_create(
-            publisher=self.author, drive=self.drive, share=share_obj
+        publish_share(
+            self.metadata["share_uid"],
+            self.drive.pk,
+            self.author.pk,
+            self.metadata["note"],
+            self.resource.pk if self.resource else None,
+            self.get_shared_objects(),
         )
+
+
+def publish_share(
+    share_uid: str,
+    drive_id: UUID,
+    author_id: UUID,
+    note: str,
+    parent_id: Optional[UUID],
+    assets: List[Union[Object, UUID]],
+) -> Share:
+    """Create (or extend) the share of an upload and notify the drive"""
+
+    args = {"pk": share_uid, "drive_id": drive_id, "author_id": author_id, "note": note}
+
+    if parent_id:
+        args["parent_id"] = parent_id
+
+    share_obj = Share.objects.filter(**args).first()
+    if not share_obj:
+        share_obj = Share.objects.create(**args)
+    share_obj.assets.add(*assets)
+
+    # notification ops here
+
+    DriveNotification.objects.get_or_create(
+        publisher_id=author_id, drive_id=drive_id, share=share_obj
+    )
+    return share_obj
+
+
+def advance_manifest(share_uid: str, paths: List[str], assets: List[UUID]) -> bool:
+    """Count the files at `paths` off an upload's manifest and record their
+    top level `assets`; the call that completes it finalizes the share, in
+    the caller's transaction, exactly once. Paths already counted (an S3
+    event delivered twice) are not counted again. False when there is no
+    manifest.
+    """
+
+    # the row stays locked until commit, so concurrent ingests count in turn
+    manifest = UploadManifest.objects.select_for_update().filter(pk=share_uid).first()
+    if not manifest:
+        return False
+
+    counted = set(manifest.ingested)
+    new = [path for path in dict.fromkeys(paths) if path not in counted]
+    manifest.remaining -= len(new)
+    manifest.ingested += new
+    manifest.assets += assets
+    manifest.updated_at = timezone.now()
+
+    if manifest.remaining <= 0:
+        finalize_upload(manifest)
+        manifest.delete()
+    else:
+        manifest.save(update_fields=["remaining", "ingested", "assets", "updated_at"])
+    return True
+
+
+def finalize_upload(manifest: UploadManifest) -> Optional[Share]:
+    """Share what a completed (or abandoned) upload delivered, if anything"""
+
+    if not manifest.assets:
+        return None
+
+    return publish_share(
+        str(manifest.pk),
+        manifest.drive_id,
+        manifest.author_id,
+        manifest.note or "",
+        manifest.parent_id,
+        list(dict.fromkeys(manifest.assets)),
+    )
+
+
+class FilePath:
+    """A single uploaded file, ingested as a tree of one"""
+
+    def __init__(self, metadata: FileMetaData, db_conn_alias: str = "") -> None:
+
+        self.metadata = metadata
+        self.tree = FileTree([metadata])
+
+    def parse_path(self) -> List[Object]:
+        return self.tree.ingest()
@@ -0,0 +1,149 @@
+import logging
+from datetime import timedelta
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from abstract.apis.aws.types import FileMetaData
+from django.core.cache import cache
+
+logger = logging.getLogger("storage")
+
+# Seconds a share's upload events are held before they are ingested together.
+INGEST_WINDOW = 5
+BUFFER_TIMEOUT = 60 * 60
+# A claimed slot still unwritten after this long belongs to a worker that
+# died between claiming and writing it; the drain stops waiting for it.
+MISSING_SLOT_TIMEOUT = 60
+# How long a share's ingest lock outlives a worker that died holding it; a
+# run takes seconds, so a crash only holds the share up this long.
+INGEST_LOCK_TIMEOUT = 60
+# Times a share's events are put back after a failed ingest before they are
+# dropped; each retry waits twice as long as the one before.
+INGEST_ATTEMPTS = 5
+# How long an issued upload URL's metadata is kept for its S3 event.
+UPLOAD_SESSION_TIMEOUT = 60 * 60 * 6
+# Uploads still incomplete after this long are finalized with what arrived.
+MANIFEST_TIMEOUT = timedelta(seconds=UPLOAD_SESSION_TIMEOUT)
+# Multipart uploads not completed after this long are aborted.
+MULTIPART_TIMEOUT = 60 * 60 * 24
+
+
+def register_upload_sessions(sessions: Dict[str, FileMetaData]) -> None:
+    """Remember what each presigned upload was issued with, by object key,
+    so the S3 event can be ingested without reading it back from S3"""
+
+    cache.set_many(
+        {f"upload:{key}": metadata for key, metadata in sessions.items()},
+        UPLOAD_SESSION_TIMEOUT,
+    )
+
+
+def pop_upload_sessions(keys: Iterable[str]) -> Dict[str, FileMetaData]:
+    """The registered metadata of the uploaded `keys` that have a session,
+    by object key; each session is used once"""
+
+    found = cache.get_many([f"upload:{key}" for key in keys])
+    cache.delete_many(list(found))
+    return {key.removeprefix("upload:"): metadata for key, metadata in found.items()}
+
+
+def keep_buffer(share_uid: str) -> None:
+    """Give the counters of a share's buffer a fresh BUFFER_TIMEOUT together,
+    so none of them expires while the others live on"""
+
+    for name in ("events", "drained", "failures"):
+        cache.touch(f"share:{share_uid}:{name}", BUFFER_TIMEOUT)
+
+
+def buffer_upload_event(metadata: FileMetaData) -> bool:
+    """Queue one uploaded file under its share.
+
+    Every event takes the next slot of the share's counter, so concurrent
+    workers never overwrite each other. Returns True for the event that
+    opens the window, whose caller schedules `ingest_share_uploads`.
+    """
+
+    share_uid = metadata["share_uid"]
+    cache.add(f"share:{share_uid}:events", 0, BUFFER_TIMEOUT)
+    slot = cache.incr(f"share:{share_uid}:events")
+    cache.set(f"share:{share_uid}:event:{slot}", metadata, BUFFER_TIMEOUT)
+    keep_buffer(share_uid)
+
+    return cache.add(f"share:{share_uid}:scheduled", True, BUFFER_TIMEOUT)
+
+
+def drain_upload_events(share_uid: str) -> Tuple[List[FileMetaData], bool]:
+    """Take every buffered event of a share, in arrival order.
+
+    The window is closed first, so an event landing while this runs opens a
+    new one. A slot that was claimed but not written yet stops the drain
+    there and is reported as pending, until MISSING_SLOT_TIMEOUT has passed
+    since it was first found missing; then it is skipped.
+    """
+
+    cache.delete(f"share:{share_uid}:scheduled")
+
+    drained = cache.get(f"share:{share_uid}:drained", 0)
+    claimed = cache.get(f"share:{share_uid}:events", 0)
+    if claimed < drained:
+        # the counter expired and started over: its slots are all new
+        drained = 0
+    slots = range(drained + 1, claimed + 1)
+    found = cache.get_many([f"share:{share_uid}:event:{slot}" for slot in slots])
+
+    uploads = []
+    for slot in slots:
+        key = f"share:{share_uid}:event:{slot}"
+        if key in found:
+            uploads.append(found[key])
+        else:
+            missing = f"share:{share_uid}:missing:{slot}"
+            since = cache.get_or_set(missing, time(), BUFFER_TIMEOUT)
+            if time() - since < MISSING_SLOT_TIMEOUT:
+                break
+            logger.warning(f"Skipped upload event {slot} of {share_uid}: never written")
+            cache.delete(missing)
+        drained = slot
+
+    cache.set(f"share:{share_uid}:drained", drained, BUFFER_TIMEOUT)
+    cache.delete_many(
+        [f"share:{share_uid}:event:{slot}" for slot in slots if slot <= drained]
+    )
+    keep_buffer(share_uid)
+
+    return uploads, drained < claimed
+
+
+def requeue_upload_events(share_uid: str, uploads: List[FileMetaData]) -> int:
+    """Put back the events of an ingest that failed, behind any buffered
+    meanwhile. Returns the number of failures of the share so far; past
+    INGEST_ATTEMPTS the events are not put back anymore."""
+
+    cache.add(f"share:{share_uid}:failures", 0, BUFFER_TIMEOUT)
+    failures = cache.incr(f"share:{share_uid}:failures")
+    if failures <= INGEST_ATTEMPTS:
+        for upload in uploads:
+            buffer_upload_event(upload)
+    keep_buffer(share_uid)
+    return failures
+
+
+def reset_upload_failures(share_uid: str) -> None:
+    """Forget the failures of a share once its events are ingested"""
+
+    cache.delete(f"share:{share_uid}:failures")
+
+
+def register_multipart_upload(upload_id: str, session: Dict[str, object]) -> None:
+    """Remember which key, drive and author a multipart upload belongs to,
+    so only they can sign, complete or abort its parts"""
+
+    cache.set(f"multipart:{upload_id}", session, MULTIPART_TIMEOUT)
+
+
+def get_multipart_upload(upload_id: str) -> Optional[Dict[str, object]]:
+    return cache.get(f"multipart:{upload_id}")
+
+
+def forget_multipart_upload(upload_id: str) -> None:
+    cache.delete(f"multipart:{upload_id}")
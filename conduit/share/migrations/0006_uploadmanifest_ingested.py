@@ -0,0 +1,21 @@
+# Generated by Django 5.0.7 on 2026-10-18 12:05
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("share", "0005_uploadmanifest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadmanifest",
+            name="ingested",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.TextField(), blank=True, default=list, size=None
+            ),
+        ),
+    ]
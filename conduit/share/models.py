@@ -1,6 +1,7 @@
 from abstract.models import TimestampUUIDMixin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from storage.models import Drive, Object
@@ -20,3 +21,25 @@ class Share(TimestampUUIDMixin):
     )
     note = models.CharField(_("Upload Message"), max_length=3000, null=True, blank=True)
     mentioned_members = models.ManyToManyField(User)
+
+
+class UploadManifest(TimestampUUIDMixin):
+    """What an upload (keyed by its share uid) still expects; the share is
+    finalized when the last file is ingested, or by the stale sweep"""
+
+    author = models.ForeignKey(
+        User, related_name="upload_manifests", on_delete=models.CASCADE
+    )
+    drive = models.ForeignKey(
+        Drive, related_name="upload_manifests", on_delete=models.CASCADE
+    )
+    parent = models.ForeignKey(
+        Object, related_name="+", null=True, on_delete=models.CASCADE
+    )
+    note = models.CharField(_("Upload Message"), max_length=3000, null=True, blank=True)
+    expected = models.PositiveIntegerField(_("Files expected"))
+    remaining = models.IntegerField(_("Files not ingested yet"))
+    # top level objects ingested so far, shared on finalize
+    assets = ArrayField(models.UUIDField(), default=list, blank=True)
+    # file paths counted off so far, so a redelivered event is not counted twice
+    ingested = ArrayField(models.TextField(), default=list, blank=True)
@@ -1,14 +1,25 @@
+import json
 import uuid
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 
-from abstract.apis.aws.handlers import S3AWSHandler
+from abstract.apis.aws.handlers import MULTIPART_THRESHOLD, S3AWSHandler
 from abstract.apis.aws.types import BaseFileObject, FileMetaData
+from botocore.exceptions import ClientError
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser
+from django.db import transaction
 from rest_framework import serializers
 from storage.models import Object
 
-from .tasks import handle_object_event
+from .file_tree import advance_manifest
+from .ingest import (
+    forget_multipart_upload,
+    get_multipart_upload,
+    register_multipart_upload,
+    register_upload_sessions,
+)
+from .models import UploadManifest
+from .tasks import handle_object_events
 
 User: AbstractBaseUser = get_user_model()
 
@@ -28,6 +39,10 @@ class PresignedURLSerializer(serializers.Serializer):
     id = serializers.CharField(max_length=36, required=True)
     url = serializers.URLField(allow_blank=True)
     path = serializers.CharField(required=False)
+    # set for files uploaded in parts, whose `url` is blank
+    upload_id = serializers.CharField(required=False)
+    part_size = serializers.IntegerField(required=False)
+    part_count = serializers.IntegerField(required=False)
 
 
 class UploadPresignedURLSerializer(serializers.Serializer):
@@ -102,8 +117,143 @@ class UploadPresignedURLSerializer(serializers.Serializer):
         else:
             root += "/"
 
+        UploadManifest.objects.create(
+            pk=self._metadata["share_uid"],
+            drive=self.context.get("drive"),
+            author=self.context.get("owner"),
+            parent=self.validated_data.get("resource"),
+            note=self._metadata["note"],
+            expected=len({file_obj["path"] for file_obj in objs}),
+            remaining=len({file_obj["path"] for file_obj in objs}),
+        )
+
+        shared = dict(self._metadata)
+        sessions = {
+            root
+            + file_obj["path"]: FileMetaData(
+                **shared,
+                file_path=file_obj["path"],
+                filesize=str(file_obj["filesize"]),
+            )
+            for file_obj in objs
+        }
+
+        # large files go up in parts, the rest with a single presigned PUT
+        small = [obj for obj in objs if obj["filesize"] <= MULTIPART_THRESHOLD]
+        large = [obj for obj in objs if obj["filesize"] > MULTIPART_THRESHOLD]
+
         handler = S3AWSHandler()
-        return handler.fetch_urls(objs, root, self._metadata)
+        urls = handler.fetch_urls(small, root, self._metadata) if small else []
+        for file_obj in large:
+            key = root + file_obj["path"]
+            upload = handler.create_multipart_upload(file_obj, root, sessions[key])
+            register_multipart_upload(
+                upload["upload_id"],
+                {
+                    "key": key,
+                    "drive_id": shared["drive_id"],
+                    "author": shared["author"],
+                    "share_uid": shared["share_uid"],
+                    "file_path": file_obj["path"],
+                    "part_count": upload["part_count"],
+                },
+            )
+            urls.append(upload)
+
+        register_upload_sessions(sessions)
+        return urls
+
+
+class MultipartUploadSerializer(serializers.Serializer):
+    """A multipart upload started by `get-upload-url`, in the requester's
+    drive; only the member who started it may act on it"""
+
+    upload_id = serializers.CharField(max_length=1024)
+
+    def validate_upload_id(self, upload_id: str) -> str:
+
+        session = get_multipart_upload(upload_id)
+        if (
+            not session
+            or session["drive_id"] != str(self.context.get("drive").pk)
+            or session["author"] != str(self.context.get("owner").pk)
+        ):
+            raise serializers.ValidationError("Unknown upload")
+
+        self.session = session
+        return upload_id
+
+
+class MultipartPartURLSerializer(MultipartUploadSerializer):
+
+    # parts to (re)sign; every part of the upload when left out
+    part_numbers = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False
+    )
+
+    def get_urls(self) -> List[Dict[str, object]]:
+
+        part_numbers = self.validated_data.get("part_numbers") or range(
+            1, self.session["part_count"] + 1
+        )
+        if max(part_numbers) > self.session["part_count"]:
+            raise serializers.ValidationError("Invalid part number")
+
+        urls = S3AWSHandler().get_upload_part_presigned_urls(
+            self.session["key"], self.validated_data["upload_id"], part_numbers
+        )
+        return [
+            {"part_number": part_number, "url": url}
+            for part_number, url in zip(part_numbers, urls)
+        ]
+
+
+class MultipartPartSerializer(serializers.Serializer):
+
+    part_number = serializers.IntegerField(min_value=1)
+    etag = serializers.CharField(max_length=1024)
+
+
+class CompleteMultipartUploadSerializer(MultipartUploadSerializer):
+
+    parts = MultipartPartSerializer(many=True, allow_empty=False)
+
+    def complete(self) -> None:
+
+        upload_id = self.validated_data["upload_id"]
+        try:
+            S3AWSHandler().complete_multipart_upload(
+                self.session["key"],
+                upload_id,
+                [
+                    {"PartNumber": part["part_number"], "ETag": part["etag"]}
+                    for part in self.validated_data["parts"]
+                ],
+            )
+        except ClientError as e:
+            raise serializers.ValidationError(f"Upload could not be completed: {e}")
+
+        # the object lands through its S3 event like any other upload
+        forget_multipart_upload(upload_id)
+
+
+class AbortMultipartUploadSerializer(MultipartUploadSerializer):
+    def abort(self) -> None:
+
+        upload_id = self.validated_data["upload_id"]
+        try:
+            S3AWSHandler().abort_multipart_upload(self.session["key"], upload_id)
+        except ClientError as e:
+            raise serializers.ValidationError(f"Upload could not be aborted: {e}")
+
+        forget_multipart_upload(upload_id)
+        # the file will never arrive, so its upload should not wait for it
+        with transaction.atomic():
+            advance_manifest(
+                self.session["share_uid"],
+                [self.session.get("file_path", self.session["key"])],
+                [],
+            )
 
 
 class DownloadPresignedURLSerializer(serializers.ModelSerializer):
@@ -116,14 +266,20 @@ class DownloadPresignedURLSerializer(serializers.ModelSerializer):
     def get_url(self) -> List[BaseFileObject]:
         return self.instance.get_object_download_url()
 
+    def iter_url(self) -> Iterator[str]:
+        """Newline-delimited JSON, one line per file"""
+
+        for file_object in self.instance.iter_object_download_url():
+            yield json.dumps(PresignedURLSerializer(file_object).data) + "\n"
+
 
 class ObjectEventSerializer(serializers.Serializer):
 
-    key = serializers.CharField(max_length=1000, required=True)
+    keys = serializers.ListField(
+        child=serializers.CharField(max_length=1000), allow_empty=False
+    )
 
     def save(self) -> None:
-        """Launch task here
-        call the task.delay here and immediately return
-        """
-        handle_object_event.delay(self.validated_data.get("key"))
+        """Queue one task for all the keys in the event and immediately return"""
+        handle_object_events.delay(self.validated_data.get("keys"))
         return
@@ -1,23 +1,159 @@
-import os
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from typing import List
 
-from abstract.apis.aws.services import AWSClientFactory
+from abstract.apis.aws.handlers import S3AWSHandler
 from abstract.apis.aws.types import FileMetaData
+from botocore.exceptions import ClientError
 from celery import shared_task
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils import timezone
 
-from .file_tree import FilePath
+from .file_tree import FileTree, finalize_upload
+from .ingest import (
+    BUFFER_TIMEOUT,
+    INGEST_ATTEMPTS,
+    INGEST_LOCK_TIMEOUT,
+    INGEST_WINDOW,
+    MANIFEST_TIMEOUT,
+    MULTIPART_TIMEOUT,
+    buffer_upload_event,
+    drain_upload_events,
+    pop_upload_sessions,
+    requeue_upload_events,
+    reset_upload_failures,
+)
+from .models import UploadManifest
 
-bucket = os.getenv("AWS_BUCKET_NAME")
+logger = logging.getLogger("storage")
+
+
+@shared_task(name="Handle File Object Uploads")
+def handle_object_events(keys: List[str]):
+    """Buffer every object created in one S3 notification under its share.
+    Metadata comes from the upload sessions, and S3 is only asked (with one
+    client) for keys without one; a key that cannot be read does not hold
+    up the rest. The first event of a share schedules its ingest."""
+
+    sessions = pop_upload_sessions(keys)
+    handler = S3AWSHandler() if len(sessions) < len(keys) else None
+
+    opened = []
+    for key in keys:
+        metadata = sessions.get(key)
+        if metadata is None:
+            try:
+                metadata = handler.get_object_metadata(key)
+            except ClientError as e:
+                logger.error(f"Error reading uploaded object {key} -> {str(e)}")
+                continue
+
+        if metadata and buffer_upload_event(FileMetaData(**metadata)):
+            opened.append(metadata["share_uid"])
+
+    for share_uid in opened:
+        ingest_share_uploads.apply_async((share_uid,), countdown=INGEST_WINDOW)
 
 
 @shared_task(name="Handle File Object Upload")
 def handle_object_event(key: str):
+    """Single key events, kept for messages queued before batching"""
+
+    handle_object_events([key])
+
+
+@shared_task(name="Ingest Share Uploads")
+def ingest_share_uploads(share_uid: str):
+    """Ingest the buffered uploads of a share as one tree per destination.
+
+    Only one run per share at a time; a run that finds another in progress,
+    or leaves events behind, schedules the next one. A tree that fails is
+    rolled back and its events are put back for a later run, unless what
+    it was uploaded into (drive, author or folder) is gone.
+    """
+
+    if not cache.add(f"share:{share_uid}:ingesting", True, INGEST_LOCK_TIMEOUT):
+        ingest_share_uploads.apply_async((share_uid,), countdown=INGEST_WINDOW)
+        return
+
+    failed = []
+    try:
+        uploads, pending = drain_upload_events(share_uid)
+
+        groups = defaultdict(list)
+        for upload in uploads:
+            groups[(upload["drive_id"], upload.get("resource_id"))].append(upload)
+
+        for group in groups.values():
+            try:
+                FileTree(group).ingest()
+            except ObjectDoesNotExist as e:
+                logger.error(f"Dropped {len(group)} upload(s) of {share_uid}: {e}")
+            except Exception:
+                logger.exception(
+                    f"Error ingesting {len(group)} upload(s) of {share_uid}"
+                )
+                failed += group
+    finally:
+        cache.delete(f"share:{share_uid}:ingesting")
+
+    if failed:
+        failures = requeue_upload_events(share_uid, failed)
+        if failures <= INGEST_ATTEMPTS:
+            ingest_share_uploads.apply_async(
+                (share_uid,), countdown=INGEST_WINDOW * 2**failures
+            )
+            return
+        logger.error(f"Gave up on {len(failed)} upload(s) of {share_uid}")
+    if uploads:
+        reset_upload_failures(share_uid)
+
+    if pending and cache.add(f"share:{share_uid}:scheduled", True, BUFFER_TIMEOUT):
+        ingest_share_uploads.apply_async((share_uid,), countdown=INGEST_WINDOW)
+
+
+@shared_task(name="Finalize Stale Uploads")
+def finalize_stale_uploads() -> int:
+    """Finalize uploads whose files stopped arriving MANIFEST_TIMEOUT ago
+    with what did arrive; returns the number of shares published"""
+
+    cutoff = timezone.now() - MANIFEST_TIMEOUT
+    stale = UploadManifest.objects.filter(updated_at__lt=cutoff).values_list(
+        "pk", flat=True
+    )
+
+    published = 0
+    for uid in stale:
+        with transaction.atomic():
+            # a manifest being counted by an ingest right now is left to it
+            manifest = (
+                UploadManifest.objects.select_for_update(skip_locked=True)
+                .filter(pk=uid)
+                .first()
+            )
+            if not manifest:
+                continue
+
+            if finalize_upload(manifest):
+                published += 1
+            manifest.delete()
+
+    if published:
+        logger.info(f"Finalized {published} stale upload(s)")
+    return published
+
+
+@shared_task(name="Abort Abandoned Uploads")
+def abort_abandoned_uploads() -> int:
+    """Abort multipart uploads left unfinished for MULTIPART_TIMEOUT, so S3
+    stops keeping their parts; returns the number aborted"""
 
-    s3_client = AWSClientFactory.build_client("s3")
-    response = s3_client.head_object(Bucket=bucket, Key=key)
-    metadata = response.get("Metadata", {})
-    print(metadata, flush=True)
-    if metadata:
+    cutoff = timezone.now() - timedelta(seconds=MULTIPART_TIMEOUT)
+    aborted = S3AWSHandler().abort_multipart_uploads(cutoff)
 
-        uploaded_file = FileMetaData(**metadata)
-        path = FilePath(uploaded_file)
-        path.parse_path()
+    if aborted:
+        logger.info(f"Aborted {aborted} abandoned multipart upload(s)")
+    return aborted
@@ -0,0 +1,136 @@
+import io
+import json
+import os
+import zipfile
+from unittest.mock import patch
+
+import pytest
+from rest_framework.test import APIClient
+from storage.models import Object
+
+
+def build_download_endpoint(asset: Object, action: str = "get-download-url") -> str:
+    return f"/api/v1/drives/{asset.drive.uid}/share/{asset.uid}/{action}/"
+
+
+@pytest.mark.django_db
+class TestDownloadAPI:
+    def test_folder_manifest_is_streamed_as_ndjson(
+        self, s3_handler, create_tree, tree_paths
+    ):
+
+        create_tree.is_directory = True
+        create_tree.save()
+        client = APIClient()
+        client.force_authenticate(create_tree.drive.owner)
+
+        response = client.get(build_download_endpoint(create_tree) + "?stream=1")
+
+        assert response.status_code == 200
+        assert response.streaming is True
+        assert response["Content-Type"] == "application/x-ndjson"
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        entries = [json.loads(line) for line in lines]
+
+        assert sorted(entry["path"] for entry in entries) == sorted(tree_paths)
+        for entry in entries:
+            assert entry["url"].startswith("https://")
+            assert Object.objects.filter(uid=entry["id"]).exists()
+
+    def test_streamed_and_buffered_manifests_match(self, s3_handler, create_tree):
+
+        create_tree.is_directory = True
+        create_tree.save()
+        client = APIClient()
+        client.force_authenticate(create_tree.drive.owner)
+
+        buffered = client.get(build_download_endpoint(create_tree)).json()
+        streamed = client.get(build_download_endpoint(create_tree) + "?stream=1")
+        lines = b"".join(streamed.streaming_content).decode().splitlines()
+
+        assert {entry["id"] for entry in buffered} == {
+            json.loads(line)["id"] for line in lines
+        }
+
+
+@pytest.mark.django_db
+class TestDownloadArchiveAPI:
+    @patch("abstract.apis.aws.handlers.DOWNLOAD_CHUNK_SIZE", 64 * 1024)
+    def test_folder_is_streamed_as_zip_in_bounded_chunks(
+        self, s3_handler, create_tree, tree_paths
+    ):
+
+        create_tree.is_directory = True
+        create_tree.save()
+        drive = create_tree.drive
+
+        contents = {}
+        for path in tree_paths:
+            contents[path] = os.urandom(300 * 1024)
+            s3_handler.client.put_object(
+                Bucket="test-bucket", Key=f"{drive.name}/{path}", Body=contents[path]
+            )
+
+        client = APIClient()
+        client.force_authenticate(drive.owner)
+        response = client.get(
+            build_download_endpoint(create_tree, "get-download-archive")
+        )
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/zip"
+        assert 'filename="home.zip"' in response["Content-Disposition"]
+
+        chunks = list(response.streaming_content)
+        # nothing close to a whole file is ever held at once
+        assert max(len(chunk) for chunk in chunks) < 2 * 64 * 1024
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            assert archive.testzip() is None
+            assert sorted(archive.namelist()) == sorted(tree_paths)
+            for path, data in contents.items():
+                assert archive.read(path) == data
+
+    def test_archive_names_are_quoted_and_encoded(self, s3_handler, create_tree):
+
+        create_tree.is_directory = True
+        create_tree.name = 'naïve "home"'
+        create_tree.save()
+
+        client = APIClient()
+        client.force_authenticate(create_tree.drive.owner)
+        response = client.get(
+            build_download_endpoint(create_tree, "get-download-archive")
+        )
+
+        assert response.status_code == 200
+        assert response["Content-Disposition"] == (
+            "attachment; filename*=utf-8''na%C3%AFve%20%22home%22.zip"
+        )
+
+    def test_empty_folders_are_left_out_of_the_archive(
+        self, s3_handler, create_tree, tree_paths
+    ):
+
+        create_tree.is_directory = True
+        create_tree.save()
+        drive = create_tree.drive
+        attic = Object.objects.create(
+            name="attic", drive=drive, path="/home/attic", is_directory=True
+        )
+        create_tree.content.add(attic)
+        for path in tree_paths:
+            s3_handler.client.put_object(
+                Bucket="test-bucket", Key=f"{drive.name}/{path}", Body=b"x"
+            )
+
+        client = APIClient()
+        client.force_authenticate(drive.owner)
+        response = client.get(
+            build_download_endpoint(create_tree, "get-download-archive")
+        )
+
+        assert response.status_code == 200
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        assert sorted(archive.namelist()) == sorted(tree_paths)
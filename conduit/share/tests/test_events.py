@@ -0,0 +1,85 @@
+import json
+import uuid
+from unittest.mock import patch
+
+import pytest
+from rest_framework.test import APIClient
+from storage.models import Object
+
+from ..tasks import handle_object_events, ingest_share_uploads
+from .test_file_path import build_metadata
+
+
+def build_sns_event(*records) -> str:
+    return json.dumps(
+        {
+            "Type": "Notification",
+            "Message": json.dumps(
+                {
+                    "Records": [
+                        {"eventName": name, "s3": {"object": {"key": key}}}
+                        for name, key in records
+                    ]
+                }
+            ),
+        }
+    )
+
+
+@pytest.mark.django_db
+class TestStorageEvents:
+    def test_every_created_record_goes_into_one_task(self):
+
+        event = build_sns_event(
+            ("ObjectCreated:Put", "vault/docs/a+b.txt"),
+            ("ObjectCreated:CompleteMultipartUpload", "vault/docs/big.iso"),
+            ("ObjectRemoved:Delete", "vault/docs/old.txt"),
+        )
+
+        with patch("share.serializers.handle_object_events") as task:
+            response = APIClient().post(
+                "/api/v1/share/process-storage-event/",
+                event,
+                content_type="text/plain",
+            )
+
+        assert response.status_code == 200
+        task.delay.assert_called_once_with(["vault/docs/a b.txt", "vault/docs/big.iso"])
+
+    def test_events_without_created_records_queue_nothing(self):
+
+        event = build_sns_event(("ObjectRemoved:Delete", "vault/docs/old.txt"))
+
+        with patch("share.serializers.handle_object_events") as task:
+            APIClient().post(
+                "/api/v1/share/process-storage-event/",
+                event,
+                content_type="text/plain",
+            )
+
+        task.delay.assert_not_called()
+
+    def test_batch_ingests_every_key(self, drive, s3_handler):
+
+        keys = ["vault/docs/a.txt", "vault/docs/b.txt", "vault/missing.txt"]
+        share_uid = str(uuid.uuid4())
+        for key in keys[:2]:
+            metadata = build_metadata(drive, key.split("/", 1)[1])
+            metadata.pop("resource_id")
+            metadata["share_uid"] = share_uid
+            s3_handler.client.put_object(
+                Bucket="test-bucket", Key=key, Body=b"x", Metadata=metadata
+            )
+
+        with patch("share.tasks.ingest_share_uploads") as ingest:
+            handle_object_events(keys)
+
+        # both files share one upload, so only the first opens an ingest window
+        ingest.apply_async.assert_called_once()
+        ingest_share_uploads(*ingest.apply_async.call_args.args[0])
+
+        docs = Object.objects.get(drive=drive, name="docs")
+        assert sorted(docs.children.values_list("name", flat=True)) == [
+            "a.txt",
+            "b.txt",
+        ]
@@ -0,0 +1,146 @@
+import io
+import uuid
+from typing import Optional
+
+import pytest
+from abstract.apis.aws.types import FileMetaData
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from storage.models import Drive, Object
+
+from ..file_tree import FilePath
+
+
+def build_metadata(
+    drive: Drive, path: str, size: int = 100, resource: Optional[Object] = None
+) -> FileMetaData:
+
+    return FileMetaData(
+        author=str(drive.owner.pk),
+        drive_id=str(drive.pk),
+        file_path=path,
+        filesize=str(size),
+        resource_id=str(resource.pk) if resource else None,
+        share_uid=str(uuid.uuid4()),
+        note="",
+        mentioned_members="",
+    )
+
+
+@pytest.mark.django_db
+class TestFilePath:
+    def test_nodes_are_linked_to_their_parent(self, drive):
+
+        for path in ["home/living/tv.jpg", "home/living/remote.jpg"]:
+            FilePath(build_metadata(drive, path)).parse_path()
+
+        home = Object.objects.get(drive=drive, name="home")
+        living = Object.objects.get(drive=drive, name="living")
+
+        assert home.parent is None
+        assert living.parent == home
+        assert living.ancestors == [home.pk]
+        assert set(living.children.values_list("name", flat=True)) == {
+            "tv.jpg",
+            "remote.jpg",
+        }
+        assert set(living.content.values_list("name", flat=True)) == {
+            "tv.jpg",
+            "remote.jpg",
+        }
+
+    def test_files_are_parsed_into_an_existing_resource(self, drive):
+
+        FilePath(build_metadata(drive, "docs/a.txt")).parse_path()
+        docs = Object.objects.get(drive=drive, name="docs")
+
+        FilePath(build_metadata(drive, "b.txt", resource=docs)).parse_path()
+        b = Object.objects.get(drive=drive, name="b.txt")
+
+        assert b.parent == docs
+        assert b.path == "/docs/b.txt"
+        assert Object.objects.filter(drive=drive, name="docs").count() == 1
+
+    def test_identical_nested_names_are_separate_nodes(self, drive):
+
+        FilePath(build_metadata(drive, "docs/docs/docs/homework.txt")).parse_path()
+        FilePath(build_metadata(drive, "docs/docs/homework.txt")).parse_path()
+
+        assert Object.objects.filter(drive=drive, name="docs").count() == 3
+        assert Object.objects.filter(drive=drive, name="homework.txt").count() == 2
+
+    def test_sibling_names_are_unique_per_directory(self, drive):
+
+        FilePath(build_metadata(drive, "home/tv.jpg")).parse_path()
+        home = Object.objects.get(drive=drive, name="home")
+
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Object.objects.create(drive=drive, parent=home, name="tv.jpg")
+
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Object.objects.create(drive=drive, name="home")
+
+    def test_sizes_roll_up_to_every_existing_ancestor(self, drive):
+
+        FilePath(build_metadata(drive, "home/living/tv.jpg", size=100)).parse_path()
+        FilePath(build_metadata(drive, "home/living/remote.jpg", size=50)).parse_path()
+        FilePath(build_metadata(drive, "home/kitchen/pot.png", size=25)).parse_path()
+
+        sizes = dict(Object.objects.filter(drive=drive).values_list("name", "size"))
+        assert sizes["home"] == 175
+        assert sizes["living"] == 150
+        assert sizes["kitchen"] == 25
+        assert sizes["tv.jpg"] == 100
+
+    def test_files_added_to_a_resource_grow_its_ancestors(self, drive):
+
+        FilePath(build_metadata(drive, "home/living/tv.jpg", size=100)).parse_path()
+        living = Object.objects.get(drive=drive, name="living")
+
+        FilePath(build_metadata(drive, "remote.jpg", 30, resource=living)).parse_path()
+
+        sizes = dict(Object.objects.filter(drive=drive).values_list("name", "size"))
+        assert sizes["living"] == 130
+        assert sizes["home"] == 130
+
+    def test_ancestor_sizes_are_updated_in_one_statement(self, drive):
+
+        FilePath(build_metadata(drive, "a/b/c/d/one.txt", size=10)).parse_path()
+        with CaptureQueriesContext(connection) as queries:
+            FilePath(build_metadata(drive, "a/b/c/d/two.txt", size=10)).parse_path()
+
+        updates = [
+            q["sql"] for q in queries if q["sql"].startswith('UPDATE "storage_object"')
+        ]
+        assert len(updates) == 1
+        assert Object.objects.get(drive=drive, name="a").size == 20
+
+    def test_drive_usage_grows_by_each_file(
+        self, drive, django_capture_on_commit_callbacks
+    ):
+
+        Drive.objects.filter(pk=drive.pk).update(used=0.0)
+        with django_capture_on_commit_callbacks(execute=True):
+            FilePath(build_metadata(drive, "home/living/tv.jpg", 100)).parse_path()
+            FilePath(build_metadata(drive, "home/kitchen/pot.png", 25)).parse_path()
+
+        drive.refresh_from_db()
+        assert drive.used == 125
+
+
+@pytest.mark.django_db
+class TestReconcileSizes:
+    def test_drifted_folder_sizes_are_recomputed_from_files(self, drive):
+
+        FilePath(build_metadata(drive, "home/living/tv.jpg", size=100)).parse_path()
+        FilePath(build_metadata(drive, "home/kitchen/pot.png", size=25)).parse_path()
+        Object.objects.filter(drive=drive, name__in=["home", "living"]).update(size=1)
+
+        out = io.StringIO()
+        call_command("reconcile_object_sizes", drive=str(drive.pk), stdout=out)
+
+        sizes = dict(Object.objects.filter(drive=drive).values_list("name", "size"))
+        assert sizes["home"] == 125
+        assert sizes["living"] == 100
+        assert "2 folder size(s) corrected" in out.getvalue()
@@ -0,0 +1,475 @@
+import threading
+import uuid
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from notifications.models import DriveNotification
+from share.models import Share
+from storage.models import Drive, Object
+
+from ..file_tree import FileTree
+from ..ingest import (
+    INGEST_ATTEMPTS,
+    INGEST_LOCK_TIMEOUT,
+    INGEST_WINDOW,
+    MISSING_SLOT_TIMEOUT,
+    buffer_upload_event,
+    drain_upload_events,
+)
+from ..tasks import ingest_share_uploads
+from .test_file_path import build_metadata
+
+
+def build_upload(drive, paths, size=10, resource=None):
+
+    share_uid = str(uuid.uuid4())
+    uploads = []
+    for path in paths:
+        metadata = build_metadata(drive, path, size=size, resource=resource)
+        metadata["share_uid"] = share_uid
+        uploads.append(metadata)
+    return uploads
+
+
+@pytest.mark.django_db
+class TestUploadBuffer:
+    def test_only_the_first_event_opens_the_window(self, drive):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt", "c.txt"])
+
+        opened = [buffer_upload_event(upload) for upload in uploads]
+
+        assert opened == [True, False, False]
+
+    def test_drain_returns_events_in_order_once(self, drive):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt"])
+        share_uid = uploads[0]["share_uid"]
+        for upload in uploads:
+            buffer_upload_event(upload)
+
+        drained, pending = drain_upload_events(share_uid)
+
+        assert [u["file_path"] for u in drained] == ["a.txt", "b.txt"]
+        assert not pending
+        assert drain_upload_events(share_uid) == ([], False)
+        # the window closed with the drain, the next event opens another
+        assert buffer_upload_event(
+            build_upload(drive, ["c.txt"])[0] | {"share_uid": share_uid}
+        )
+
+    def test_a_claimed_but_unwritten_slot_is_left_pending(self, drive):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt"])
+        share_uid = uploads[0]["share_uid"]
+        buffer_upload_event(uploads[0])
+        cache.incr(f"share:{share_uid}:events")  # a writer between incr and set
+
+        drained, pending = drain_upload_events(share_uid)
+
+        assert [u["file_path"] for u in drained] == ["a.txt"]
+        assert pending
+
+    def test_a_slot_never_written_is_skipped_after_a_while(self, drive):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt"])
+        share_uid = uploads[0]["share_uid"]
+        cache.add(f"share:{share_uid}:events", 0)
+        cache.incr(f"share:{share_uid}:events")  # a worker died after its incr
+        buffer_upload_event(uploads[0])
+        buffer_upload_event(uploads[1])
+
+        with patch("share.ingest.time", return_value=1000):
+            assert drain_upload_events(share_uid) == ([], True)
+        with patch("share.ingest.time", return_value=1000 + MISSING_SLOT_TIMEOUT):
+            drained, pending = drain_upload_events(share_uid)
+
+        assert drained == uploads
+        assert not pending
+
+    def test_events_after_the_counter_expired_are_drained(self, drive):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt", "c.txt"])
+        share_uid = uploads[0]["share_uid"]
+        buffer_upload_event(uploads[0])
+        buffer_upload_event(uploads[1])
+        drain_upload_events(share_uid)
+
+        # an upload outlasting the buffer: the counter is gone, drained is not
+        cache.delete(f"share:{share_uid}:events")
+        buffer_upload_event(uploads[2])
+
+        assert drain_upload_events(share_uid) == ([uploads[2]], False)
+
+    def test_every_write_keeps_the_counters_alive_together(self, drive):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt"])
+        share_uid = uploads[0]["share_uid"]
+        buffer_upload_event(uploads[0])
+        drain_upload_events(share_uid)
+
+        with patch("share.ingest.cache.touch", wraps=cache.touch) as touch:
+            buffer_upload_event(uploads[1])
+
+        touched = {call.args[0] for call in touch.call_args_list}
+        assert {
+            f"share:{share_uid}:events",
+            f"share:{share_uid}:drained",
+            f"share:{share_uid}:failures",
+        } <= touched
+
+
+@pytest.mark.django_db
+class TestFileTree:
+    def test_folder_upload_costs_queries_per_level_not_per_file(self, drive):
+
+        small = build_upload(drive, [f"small/d{i}/f.txt" for i in range(2)])
+        with CaptureQueriesContext(connection) as few:
+            FileTree(small).ingest()
+
+        large = build_upload(
+            drive, [f"large/d{i}/sub/f{j}.txt" for i in range(10) for j in range(5)]
+        )
+        with CaptureQueriesContext(connection) as many:
+            FileTree(large).ingest()
+
+        assert Object.objects.filter(drive=drive, name__startswith="f").count() == 52
+        assert len(many) == len(few)
+
+    def test_deep_paths_resolve_in_constant_queries(self, drive):
+
+        shallow = "/".join(["s"] * 2) + "/f.txt"
+        deep = "/".join(f"d{i}" for i in range(20)) + "/f.txt"
+
+        with CaptureQueriesContext(connection) as new_shallow:
+            FileTree(build_upload(drive, [shallow])).ingest()
+        with CaptureQueriesContext(connection) as new_deep:
+            FileTree(build_upload(drive, [deep])).ingest()
+        with CaptureQueriesContext(connection) as existing_deep:
+            FileTree(build_upload(drive, [deep.replace("f.txt", "g.txt")])).ingest()
+
+        g = Object.objects.get(drive=drive, name="g.txt")
+        assert len(g.ancestors) == 20
+        assert g.parent == Object.objects.get(drive=drive, name="d19")
+        assert len(new_deep) == len(new_shallow)
+        # the same again, plus growing the 20 existing folders in one UPDATE
+        assert len(existing_deep) == len(new_deep) + 1
+
+    def test_names_taken_after_resolving_are_retried(self, drive):
+
+        FileTree(build_upload(drive, ["docs/a.txt"], size=10)).ingest()
+        resolve = Object.objects.resolve_paths
+        calls = []
+
+        def resolve_once_stale(*args):
+            # the resolve after locking misses "docs", as if a writer that does
+            # not lock names created it right after
+            calls.append(args)
+            return {} if len(calls) == 2 else resolve(*args)
+
+        with patch.object(
+            Object.objects, "resolve_paths", side_effect=resolve_once_stale
+        ):
+            FileTree(build_upload(drive, ["docs/b.txt"], size=5)).ingest()
+
+        docs = Object.objects.get(drive=drive, name="docs")
+        assert sorted(docs.content.values_list("name", flat=True)) == ["a.txt", "b.txt"]
+        assert docs.size == 15
+
+    def test_sizes_roll_up_once_per_node(self, drive):
+
+        FileTree(build_upload(drive, ["home/living/tv.jpg"], size=100)).ingest()
+        uploads = build_upload(
+            drive, ["home/living/remote.jpg", "home/kitchen/pot.png"], size=25
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            FileTree(uploads).ingest()
+
+        sizes = dict(Object.objects.filter(drive=drive).values_list("name", "size"))
+        assert sizes == {
+            "home": 150,
+            "living": 125,
+            "kitchen": 25,
+            "tv.jpg": 100,
+            "remote.jpg": 25,
+            "pot.png": 25,
+        }
+        updates = [
+            q["sql"] for q in queries if q["sql"].startswith('UPDATE "storage_object"')
+        ]
+        assert len(updates) == 1
+
+    def test_usage_counts_only_new_files(
+        self, drive, django_capture_on_commit_callbacks
+    ):
+
+        Drive.objects.filter(pk=drive.pk).update(used=0.0)
+        with django_capture_on_commit_callbacks(execute=True):
+            FileTree(build_upload(drive, ["a/one.txt"], size=10)).ingest()
+            FileTree(build_upload(drive, ["a/one.txt", "a/two.txt"])).ingest()
+
+        drive.refresh_from_db()
+        assert drive.used == 20
+        assert Object.objects.get(drive=drive, name="a").size == 20
+
+    def test_a_file_uploaded_again_moves_sizes_by_the_difference(
+        self, drive, django_capture_on_commit_callbacks
+    ):
+
+        Drive.objects.filter(pk=drive.pk).update(used=0.0)
+        with django_capture_on_commit_callbacks(execute=True):
+            FileTree(build_upload(drive, ["a/b/one.txt", "a/two.txt"])).ingest()
+            FileTree(build_upload(drive, ["a/b/one.txt"], size=4)).ingest()
+
+        drive.refresh_from_db()
+        sizes = dict(Object.objects.filter(drive=drive).values_list("name", "size"))
+        assert sizes == {"a": 14, "b": 4, "one.txt": 4, "two.txt": 10}
+        assert drive.used == 14
+
+    def test_new_nodes_are_linked_into_a_resource(self, drive):
+
+        FileTree(build_upload(drive, ["docs/a.txt"], size=10)).ingest()
+        docs = Object.objects.get(drive=drive, name="docs")
+
+        FileTree(build_upload(drive, ["notes/b.txt"], size=5, resource=docs)).ingest()
+
+        notes = Object.objects.get(drive=drive, name="notes")
+        b = Object.objects.get(drive=drive, name="b.txt")
+        assert notes.path == "/docs/notes"
+        assert b.ancestors == [docs.pk, notes.pk]
+        assert list(docs.content.values_list("name", flat=True).order_by("name")) == [
+            "a.txt",
+            "notes",
+        ]
+        assert Object.objects.get(pk=docs.pk).size == 15
+
+    def test_share_is_finalized_once(self, drive, django_capture_on_commit_callbacks):
+
+        uploads = build_upload(drive, ["album/1.jpg", "album/2.jpg", "cover.jpg"])
+
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            FileTree(uploads).ingest()
+
+        assert len(callbacks) == 3  # usage delta, version bump, share finalize
+        share = Share.objects.get(pk=uploads[0]["share_uid"])
+        assert sorted(share.assets.values_list("name", flat=True)) == [
+            "album",
+            "cover.jpg",
+        ]
+        assert DriveNotification.objects.filter(share=share).count() == 1
+
+
+@pytest.mark.django_db
+class TestIngestShareUploads:
+    def test_buffered_uploads_are_ingested_together(self, drive):
+
+        uploads = build_upload(drive, ["album/1.jpg", "album/2.jpg"])
+        for upload in uploads:
+            buffer_upload_event(upload)
+
+        with patch("share.tasks.FileTree") as tree:
+            ingest_share_uploads(uploads[0]["share_uid"])
+
+        tree.assert_called_once_with(uploads)
+
+    def test_a_run_in_progress_defers_the_next(self, drive):
+
+        share_uid = build_upload(drive, ["a.txt"])[0]["share_uid"]
+        cache.add(f"share:{share_uid}:ingesting", True)
+
+        with patch("share.tasks.ingest_share_uploads.apply_async") as schedule, patch(
+            "share.tasks.drain_upload_events"
+        ) as drain:
+            ingest_share_uploads(share_uid)
+
+        drain.assert_not_called()
+        schedule.assert_called_once()
+
+    def test_the_lock_is_short_lived_and_released(self, drive):
+
+        share_uid = build_upload(drive, ["a.txt"])[0]["share_uid"]
+
+        with patch("share.tasks.cache.add", wraps=cache.add) as add:
+            ingest_share_uploads(share_uid)
+
+        # a worker dying mid-run holds the share up for a minute, not an hour
+        add.assert_any_call(f"share:{share_uid}:ingesting", True, INGEST_LOCK_TIMEOUT)
+        assert cache.get(f"share:{share_uid}:ingesting") is None
+
+    def test_a_failed_tree_is_put_back_and_retried(self, drive):
+
+        uploads = build_upload(drive, ["album/1.jpg", "album/2.jpg"])
+        share_uid = uploads[0]["share_uid"]
+        for upload in uploads:
+            buffer_upload_event(upload)
+
+        with patch(
+            "share.file_tree.FileTree.apply_sizes", side_effect=ValueError("boom")
+        ), patch("share.tasks.ingest_share_uploads.apply_async") as schedule:
+            ingest_share_uploads(share_uid)
+
+        # nothing of the tree was kept, and its events wait for the retry
+        assert not Object.objects.filter(drive=drive).exists()
+        schedule.assert_called_once_with((share_uid,), countdown=INGEST_WINDOW * 2)
+        drained, _ = drain_upload_events(share_uid)
+        assert drained == uploads
+
+    def test_retries_stop_after_the_last_attempt(self, drive):
+
+        uploads = build_upload(drive, ["a.txt"])
+        share_uid = uploads[0]["share_uid"]
+        cache.set(f"share:{share_uid}:failures", INGEST_ATTEMPTS)
+        buffer_upload_event(uploads[0])
+
+        with patch(
+            "share.tasks.FileTree.ingest", side_effect=ValueError("boom")
+        ), patch("share.tasks.ingest_share_uploads.apply_async") as schedule:
+            ingest_share_uploads(share_uid)
+
+        schedule.assert_not_called()
+        assert drain_upload_events(share_uid) == ([], False)
+
+    def test_failures_are_forgotten_once_the_share_ingests(self, drive):
+
+        uploads = build_upload(drive, ["a.txt"])
+        share_uid = uploads[0]["share_uid"]
+        cache.set(f"share:{share_uid}:failures", 2)
+        buffer_upload_event(uploads[0])
+
+        ingest_share_uploads(share_uid)
+
+        assert cache.get(f"share:{share_uid}:failures") is None
+
+    def test_uploads_into_a_missing_folder_are_dropped(self, drive):
+
+        missing = Object(pk=uuid.uuid4())
+        uploads = build_upload(drive, ["a.txt"], resource=missing)
+        buffer_upload_event(uploads[0])
+
+        with patch("share.tasks.ingest_share_uploads.apply_async") as schedule:
+            ingest_share_uploads(uploads[0]["share_uid"])
+
+        schedule.assert_not_called()
+        assert drain_upload_events(uploads[0]["share_uid"]) == ([], False)
+
+
+def hold_ingest(uploads, ingested, release):
+    """Ingest in a worker thread and keep the transaction open until released"""
+
+    try:
+        with transaction.atomic():
+            FileTree(uploads).ingest()
+            ingested.set()
+            release.wait(10)
+    finally:
+        connections.close_all()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentIngest:
+    def test_uploads_to_separate_folders_run_in_parallel(self, drive):
+
+        workers = 4
+        barrier = threading.Barrier(workers, timeout=10)
+        errors = []
+
+        def ingest(folder):
+            try:
+                with transaction.atomic():
+                    FileTree(build_upload(drive, [f"{folder}/a/b.txt"])).ingest()
+                    # every worker is inside its transaction at the same time,
+                    # which a drive-wide lock would never allow
+                    barrier.wait()
+            except threading.BrokenBarrierError as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=ingest, args=(f"folder{i}",))
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(15)
+
+        assert not errors
+        assert Object.objects.filter(drive=drive, name="b.txt").count() == workers
+
+    def test_only_the_names_being_created_are_locked(self, drive):
+
+        FileTree(build_upload(drive, ["home/readme.txt"])).ingest()
+        home = Object.objects.get(drive=drive, name="home")
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_name():
+            try:
+                with transaction.atomic():
+                    Object.objects.lock_names(drive.pk, [(home.pk, "alice")])
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        def ingest(path):
+            try:
+                FileTree(build_upload(drive, [path])).ingest()
+            finally:
+                connections.close_all()
+
+        holder = threading.Thread(target=hold_name)
+        holder.start()
+        assert locked.wait(10)
+
+        # /home exists, so another name in it is not held up
+        other = threading.Thread(target=ingest, args=("home/bob/a.txt",))
+        other.start()
+        other.join(5)
+        assert not other.is_alive()
+
+        same = threading.Thread(target=ingest, args=("home/alice/a.txt",))
+        same.start()
+        same.join(1)
+        assert same.is_alive()
+
+        release.set()
+        holder.join(10)
+        same.join(10)
+        assert sorted(home.children.values_list("name", flat=True)) == [
+            "alice",
+            "bob",
+            "readme.txt",
+        ]
+
+    def test_uploads_to_the_same_folder_wait_for_each_other(self, drive):
+
+        ingested, release = threading.Event(), threading.Event()
+        first = threading.Thread(
+            target=hold_ingest,
+            args=(build_upload(drive, ["docs/a.txt"]), ingested, release),
+        )
+        first.start()
+        assert ingested.wait(10)
+
+        second = threading.Thread(
+            target=hold_ingest,
+            args=(build_upload(drive, ["docs/b.txt"]), threading.Event(), release),
+        )
+        second.start()
+        second.join(1)
+        assert second.is_alive()
+
+        release.set()
+        first.join(10)
+        second.join(10)
+
+        docs = Object.objects.get(drive=drive, name="docs")
+        assert sorted(docs.children.values_list("name", flat=True)) == [
+            "a.txt",
+            "b.txt",
+        ]
@@ -0,0 +1,323 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from abstract.apis.aws.handlers import MAX_PART_SIZE, MIN_PART_SIZE, get_part_size
+from django.core.cache import cache
+from django.utils import timezone
+from notifications.models import DriveNotification
+from rest_framework.test import APIClient
+from storage.models import Drive
+
+from ..file_tree import FileTree
+from ..ingest import MANIFEST_TIMEOUT, MULTIPART_TIMEOUT, pop_upload_sessions
+from ..models import Share, UploadManifest
+from ..tasks import (
+    abort_abandoned_uploads,
+    finalize_stale_uploads,
+    handle_object_events,
+)
+from .test_ingest import build_upload
+
+
+def build_upload_endpoint(drive: Drive, action: str = "get-upload-url") -> str:
+    return f"/api/v1/drives/{drive.uid}/share/{action}/"
+
+
+def build_files(*paths, size=10):
+    return [
+        {
+            "id": str(i),
+            "filename": path.rsplit("/", 1)[-1],
+            "filesize": size,
+            "path": path,
+        }
+        for i, path in enumerate(paths)
+    ]
+
+
+def request_urls(drive, *paths, size=10):
+
+    client = APIClient()
+    client.force_authenticate(drive.owner)
+    return client.post(
+        build_upload_endpoint(drive),
+        {"files": build_files(*paths, size=size), "bulk": True},
+        format="json",
+    )
+
+
+def build_manifest(drive, uploads, expected=None):
+
+    expected = expected if expected is not None else len(uploads)
+    return UploadManifest.objects.create(
+        pk=uploads[0]["share_uid"],
+        drive=drive,
+        author=drive.owner,
+        expected=expected,
+        remaining=expected,
+    )
+
+
+@pytest.mark.django_db
+class TestUploadSessions:
+    def test_issued_urls_register_a_session_per_object_key(self, drive, s3_handler):
+
+        response = request_urls(drive, "docs/a.txt", "docs/b.txt")
+
+        assert response.status_code == 200
+        sessions = pop_upload_sessions(["vault/docs/a.txt", "vault/docs/b.txt"])
+        assert sessions["vault/docs/a.txt"]["file_path"] == "docs/a.txt"
+        assert sessions["vault/docs/b.txt"]["filesize"] == "10"
+        assert sessions["vault/docs/a.txt"]["drive_id"] == str(drive.pk)
+        assert (
+            sessions["vault/docs/a.txt"]["share_uid"]
+            == sessions["vault/docs/b.txt"]["share_uid"]
+        )
+        # a session is used once
+        assert pop_upload_sessions(["vault/docs/a.txt"]) == {}
+
+    def test_events_with_a_session_skip_head_object(self, drive, s3_handler):
+
+        request_urls(drive, "docs/a.txt", "docs/b.txt")
+
+        with patch("share.tasks.S3AWSHandler") as handler, patch(
+            "share.tasks.ingest_share_uploads"
+        ) as ingest:
+            handle_object_events(["vault/docs/a.txt", "vault/docs/b.txt"])
+
+        handler.assert_not_called()
+        ingest.apply_async.assert_called_once()
+
+    def test_events_without_a_session_read_the_object(self, drive, s3_handler):
+
+        request_urls(drive, "docs/a.txt")
+        cache.clear()
+
+        with patch.object(
+            s3_handler.__class__, "get_object_metadata", return_value={}
+        ) as head, patch("share.tasks.ingest_share_uploads"):
+            handle_object_events(["vault/docs/a.txt"])
+
+        head.assert_called_once_with("vault/docs/a.txt")
+
+
+@pytest.mark.django_db
+class TestUploadManifest:
+    def test_issuing_urls_records_the_expected_files(self, drive, s3_handler):
+
+        request_urls(drive, "docs/a.txt", "docs/b.txt", "c.txt")
+
+        manifest = UploadManifest.objects.get(drive=drive)
+        assert manifest.expected == manifest.remaining == 3
+        assert manifest.author == drive.owner
+
+    def test_the_share_is_finalized_once_when_the_last_file_lands(self, drive):
+
+        uploads = build_upload(drive, ["album/1.jpg", "album/2.jpg", "cover.jpg"])
+        build_manifest(drive, uploads)
+
+        FileTree(uploads[:2]).ingest()
+        assert not Share.objects.filter(pk=uploads[0]["share_uid"]).exists()
+        assert UploadManifest.objects.get().remaining == 1
+
+        FileTree(uploads[2:]).ingest()
+
+        share = Share.objects.get(pk=uploads[0]["share_uid"])
+        assert sorted(share.assets.values_list("name", flat=True)) == [
+            "album",
+            "cover.jpg",
+        ]
+        assert DriveNotification.objects.filter(share=share).count() == 1
+        assert not UploadManifest.objects.exists()
+
+    def test_a_redelivered_file_is_counted_once(self, drive):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt"])
+        build_manifest(drive, uploads)
+
+        FileTree(uploads[:1]).ingest()
+        FileTree(uploads[:1]).ingest()
+
+        manifest = UploadManifest.objects.get()
+        assert manifest.remaining == 1
+        assert manifest.ingested == ["a.txt"]
+        assert not Share.objects.filter(pk=uploads[0]["share_uid"]).exists()
+
+        FileTree(uploads[1:]).ingest()
+
+        assert Share.objects.get(pk=uploads[0]["share_uid"]).assets.count() == 2
+
+    def test_files_after_completion_extend_the_share(
+        self, drive, django_capture_on_commit_callbacks
+    ):
+
+        uploads = build_upload(drive, ["a.txt", "b.txt"])
+        build_manifest(drive, uploads, expected=1)
+
+        FileTree(uploads[:1]).ingest()
+        with django_capture_on_commit_callbacks(execute=True):
+            FileTree(uploads[1:]).ingest()
+
+        share = Share.objects.get(pk=uploads[0]["share_uid"])
+        assert share.assets.count() == 2
+        assert DriveNotification.objects.filter(share=share).count() == 1
+
+    def test_stale_manifests_are_finalized_with_what_arrived(self, drive):
+
+        partial = build_upload(drive, ["a.txt", "b.txt"])
+        build_manifest(drive, partial)
+        FileTree(partial[:1]).ingest()
+        empty = build_manifest(drive, build_upload(drive, ["c.txt"]))
+        UploadManifest.objects.update(updated_at=timezone.now() - MANIFEST_TIMEOUT)
+        recent = build_manifest(drive, build_upload(drive, ["d.txt"]))
+
+        assert finalize_stale_uploads() == 1
+
+        share = Share.objects.get(pk=partial[0]["share_uid"])
+        assert list(share.assets.values_list("name", flat=True)) == ["a.txt"]
+        assert not Share.objects.filter(pk=empty.pk).exists()
+        assert [
+            str(uid) for uid in UploadManifest.objects.values_list("pk", flat=True)
+        ] == [recent.pk]
+
+
+GiB = 1024 * 1024 * 1024
+
+
+@pytest.mark.django_db
+class TestMultipartUpload:
+    def start_upload(self, drive, size=3 * GiB):
+
+        response = request_urls(drive, "media/film.mkv", size=size)
+        return response.json()["presigned_urls"][0]
+
+    def post(self, drive, action, data):
+
+        client = APIClient()
+        client.force_authenticate(drive.owner)
+        return client.post(build_upload_endpoint(drive, action), data, format="json")
+
+    def test_part_size_adapts_to_the_file(self):
+
+        assert get_part_size(200 * 1024 * 1024) == MIN_PART_SIZE
+        assert get_part_size(50 * GiB) == 64 * 1024 * 1024
+        assert get_part_size(5 * 1024 * GiB) == MAX_PART_SIZE
+
+    def test_large_files_get_a_multipart_upload(self, drive, s3_handler):
+
+        response = request_urls(drive, "media/film.mkv", size=3 * GiB)
+        small = request_urls(drive, "docs/b.txt")
+
+        uploads = {item["path"]: item for item in response.json()["presigned_urls"]}
+        assert uploads["media/film.mkv"]["url"] == ""
+        assert uploads["media/film.mkv"]["upload_id"]
+        assert uploads["media/film.mkv"]["part_size"] == 8 * 1024 * 1024
+        assert uploads["media/film.mkv"]["part_count"] == 384
+        assert "upload_id" not in small.json()["presigned_urls"][0]
+
+    def test_part_urls_are_signed_in_one_call(self, drive, s3_handler):
+
+        upload = self.start_upload(drive)
+
+        every = self.post(drive, "get-part-urls", {"upload_id": upload["upload_id"]})
+        retry = self.post(
+            drive,
+            "get-part-urls",
+            {"upload_id": upload["upload_id"], "part_numbers": [3, 7]},
+        )
+
+        assert every.status_code == 200
+        parts = every.json()["parts"]
+        assert [part["part_number"] for part in parts] == list(range(1, 385))
+        assert "partNumber=1&" in parts[0]["url"]
+        assert [part["part_number"] for part in retry.json()["parts"]] == [3, 7]
+
+    def test_unknown_uploads_and_parts_are_rejected(self, drive, s3_handler):
+
+        upload = self.start_upload(drive)
+
+        unknown = self.post(drive, "get-part-urls", {"upload_id": "nope"})
+        too_far = self.post(
+            drive,
+            "get-part-urls",
+            {"upload_id": upload["upload_id"], "part_numbers": [385]},
+        )
+
+        assert unknown.status_code == 400
+        assert too_far.status_code == 400
+
+    def test_completed_uploads_are_assembled_with_their_metadata(
+        self, drive, s3_handler
+    ):
+
+        upload = self.start_upload(drive)
+        key = "vault/media/film.mkv"
+        part = s3_handler.client.upload_part(
+            Bucket="test-bucket",
+            Key=key,
+            UploadId=upload["upload_id"],
+            PartNumber=1,
+            Body=b"x" * 10,
+        )
+
+        response = self.post(
+            drive,
+            "complete-multipart-upload",
+            {
+                "upload_id": upload["upload_id"],
+                "parts": [{"part_number": 1, "etag": part["ETag"]}],
+            },
+        )
+
+        assert response.status_code == 204
+        metadata = s3_handler.get_object_metadata(key)
+        assert metadata["file_path"] == "media/film.mkv"
+        assert metadata["drive_id"] == str(drive.pk)
+        # a finished upload cannot be completed or aborted again
+        again = self.post(
+            drive, "abort-multipart-upload", {"upload_id": upload["upload_id"]}
+        )
+        assert again.status_code == 400
+
+    def test_aborted_uploads_stop_holding_their_share(self, drive, s3_handler):
+
+        upload = self.start_upload(drive)
+        assert UploadManifest.objects.get().remaining == 1
+
+        response = self.post(
+            drive, "abort-multipart-upload", {"upload_id": upload["upload_id"]}
+        )
+
+        assert response.status_code == 204
+        # nothing else was expected, so the empty upload is closed out
+        assert not UploadManifest.objects.exists()
+        assert not Share.objects.exists()
+        listed = s3_handler.client.list_multipart_uploads(Bucket="test-bucket")
+        assert not listed.get("Uploads")
+
+    def test_abandoned_uploads_are_aborted(self, drive, s3_handler):
+
+        self.start_upload(drive)
+        started = s3_handler.client.list_multipart_uploads(Bucket="test-bucket")[
+            "Uploads"
+        ][0]["Initiated"]
+
+        assert s3_handler.abort_multipart_uploads(started) == 0
+        assert s3_handler.abort_multipart_uploads(started + timedelta(seconds=1)) == 1
+        listed = s3_handler.client.list_multipart_uploads(Bucket="test-bucket")
+        assert not listed.get("Uploads")
+
+    def test_the_sweep_aborts_uploads_older_than_the_timeout(self):
+
+        with patch("share.tasks.S3AWSHandler") as handler:
+            handler.return_value.abort_multipart_uploads.return_value = 2
+            assert abort_abandoned_uploads() == 2
+
+        (cutoff,) = handler.return_value.abort_multipart_uploads.call_args.args
+        age = timezone.now() - cutoff
+        assert (
+            timedelta(seconds=MULTIPART_TIMEOUT)
+            <= age
+            < timedelta(seconds=MULTIPART_TIMEOUT + 60)
+        )
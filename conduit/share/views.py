@@ -1,8 +1,11 @@
 import json
 import urllib
+from typing import List
 
-from django.http import HttpRequest
+from abstract.apis.aws.handlers import S3AWSHandler
+from django.http import HttpRequest, StreamingHttpResponse
 from django.shortcuts import HttpResponse
+from django.utils.http import content_disposition_header
 from rest_framework import generics
 from rest_framework.decorators import action
 from rest_framework.exceptions import status
@@ -12,8 +15,12 @@ from rest_framework.viewsets import ViewSet
 from storage.models import Drive, Object
 from storage.permissions import IsDriveOwnerOrMember
 
+from .archive import get_archive_entries, iter_archive
 from .serializers import (
+    AbortMultipartUploadSerializer,
+    CompleteMultipartUploadSerializer,
     DownloadPresignedURLSerializer,
+    MultipartPartURLSerializer,
     ObjectEventSerializer,
     PresignedURLSerializer,
     UploadPresignedURLSerializer,
@@ -24,11 +31,7 @@ class ShareViewSet(ViewSet):
 
     serializer_class = UploadPresignedURLSerializer
     permission_classes = [IsAuthenticated, IsDriveOwnerOrMember]
-    queryset = (
-        Drive.objects.prefetch_related("members")
-        .select_related("owner")
-        .filter(is_active=True)
-    )
+    queryset = Drive.objects.select_related("owner").filter(is_active=True)
 
     def get_object(self) -> Drive:
         drive = self.queryset.get(pk=self.kwargs.get("drives_uid"))
@@ -38,11 +41,8 @@ class ShareViewSet(ViewSet):
     def get_file_object(self) -> Object:
 
         obj_pk = self.kwargs.get("pk")
-        file_object = (
-            Object.objects.select_related("drive")
-            .prefetch_related("content")
-            .get(pk=obj_pk)
-        )
+        # folder contents are resolved in one query when the urls are built
+        file_object = Object.objects.select_related("drive").get(pk=obj_pk)
         self.check_object_permissions(self.request, file_object.drive)
 
         return file_object
@@ -65,44 +65,94 @@ class ShareViewSet(ViewSet):
             status=status.HTTP_200_OK,
         )
 
+    def get_multipart_serializer(self, serializer_class):
+
+        serializer = serializer_class(
+            data=self.request.data,
+            context={"drive": self.get_object(), "owner": self.request.user},
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    @action(methods=["POST"], detail=False, url_path="get-part-urls")
+    def get_part_urls(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Signs the parts of a multipart upload in one call: all of them, or
+        the `part_numbers` being retried"""
+
+        serializer = self.get_multipart_serializer(MultipartPartURLSerializer)
+        return Response({"parts": serializer.get_urls()}, status=status.HTTP_200_OK)
+
+    @action(methods=["POST"], detail=False, url_path="complete-multipart-upload")
+    def complete_multipart_upload(
+        self, request: HttpRequest, *args, **kwargs
+    ) -> HttpResponse:
+
+        self.get_multipart_serializer(CompleteMultipartUploadSerializer).complete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(methods=["POST"], detail=False, url_path="abort-multipart-upload")
+    def abort_multipart_upload(
+        self, request: HttpRequest, *args, **kwargs
+    ) -> HttpResponse:
+
+        self.get_multipart_serializer(AbortMultipartUploadSerializer).abort()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(methods=["GET"], detail=True, url_path="get-download-url")
     def get_download_url(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
         asset = self.get_file_object()
         serializer = DownloadPresignedURLSerializer(asset)
+
+        if request.query_params.get("stream"):
+            # ?stream=1 -> ndjson sent as the folder is walked, for big folders
+            return StreamingHttpResponse(
+                serializer.iter_url(), content_type="application/x-ndjson"
+            )
+
         urls = serializer.get_url()
         return Response(
             PresignedURLSerializer(urls, many=True).data,
             status.HTTP_200_OK,
         )
 
+    @action(methods=["GET"], detail=True, url_path="get-download-archive")
+    def get_download_archive(
+        self, request: HttpRequest, *args, **kwargs
+    ) -> HttpResponse:
+        """Streams the asset as a single zip, read from S3 chunk by chunk"""
+
+        asset = self.get_file_object()
+        archive = iter_archive(get_archive_entries(asset), S3AWSHandler())
+
+        response = StreamingHttpResponse(archive, content_type="application/zip")
+        response["Content-Disposition"] = content_disposition_header(
+            as_attachment=True, filename=f"{asset.name}.zip"
+        )
+        return response
+
 
 class StorageObjectEventWebhookView(generics.GenericAPIView):
 
     serializer_class = ObjectEventSerializer
     permission_classes = [AllowAny]
 
-    def parse_sns_event_data(self, event_data: dict) -> str:
+    def parse_sns_event_data(self, event_data: dict) -> List[str]:
         """
-        Parses SNS message data to get the key of the storage object
+        Parses SNS message data to get the keys of the created storage objects
         :params -> event_data: dict (AWS SNS json data)
-        :returns - Key
+        :returns - Keys of every ObjectCreated:* record (Put, Post, Copy and
+        CompleteMultipartUpload alike)
         N.B I need to find a way to return error status codes here in case of failures so AWS can trigger a retry
         """
 
-        key = None
         event_data = json.loads(event_data)
         event_message = json.loads(event_data["Message"])
-        event_name = event_message["Records"][0]["eventName"]
-
-        if event_name == "ObjectCreated:Put":
-            print(event_data)
-            key = urllib.parse.unquote_plus(
-                event_message["Records"][0]["s3"]["object"]["key"],
-                encoding="utf-8",
-            )
-            print(key, flush=True)
 
-        return key
+        return [
+            urllib.parse.unquote_plus(record["s3"]["object"]["key"], encoding="utf-8")
+            for record in event_message.get("Records", [])
+            if record["eventName"].startswith("ObjectCreated:")
+        ]
 
     def post(self, request: HttpRequest) -> HttpResponse:
 
@@ -110,10 +160,10 @@ class StorageObjectEventWebhookView(generics.GenericAPIView):
         if request.headers.get("x-amz-sns-message-type") == "SubscriptionConfirmation":
             print(json.loads(data), flush=True)
         else:
-            key = self.parse_sns_event_data(data)
+            keys = self.parse_sns_event_data(data)
 
-            if key:
-                serializer = self.serializer_class(data={"key": key})
+            if keys:
+                serializer = self.serializer_class(data={"keys": keys})
                 serializer.is_valid(raise_exception=True)
                 serializer.save()
 
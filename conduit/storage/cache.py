@@ -0,0 +1,92 @@
+import hashlib
+import time
+from typing import Any, Callable, Dict, List
+from uuid import UUID
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Object
+from .serializers import ObjectPathSerializer
+
+BREADCRUMBS_TIMEOUT = 60 * 60
+TREE_TIMEOUT = 60 * 60
+
+
+def get_breadcrumbs(obj: Object) -> List[Dict[str, str]]:
+    """Cached `Object.parse_path`, serialized.
+
+    Entries are kept under the drive's version, so any change to the drive
+    (renaming a folder above the object included) is a miss. They also
+    remember the ancestor chain they were built from, so a move that did
+    not bump the version is caught too.
+    """
+
+    version = get_drive_version(obj.drive_id)
+    key = f"object:{obj.pk}:breadcrumbs:v{version}"
+    chain = [str(uid) for uid in obj.ancestors]
+
+    cached = cache.get(key)
+    if cached and cached["ancestors"] == chain:
+        return cached["nodes"]
+
+    nodes = ObjectPathSerializer(obj.parse_path(), many=True).data
+    cache.set(key, {"ancestors": chain, "nodes": nodes}, BREADCRUMBS_TIMEOUT)
+    return nodes
+
+
+def get_drive_version(drive_id: UUID) -> int:
+    """The drive's change counter, started on first read.
+
+    A fresh counter starts from the clock rather than 1 so that a counter
+    evicted from the cache never comes back at a version already used.
+    """
+
+    version = cache.get(f"drive:{drive_id}:version")
+    if version is None:
+        cache.add(f"drive:{drive_id}:version", time.time_ns(), None)
+        version = cache.get(f"drive:{drive_id}:version")
+    return version
+
+
+def bump_drive_version(drive_id: UUID) -> None:
+    """Mark everything cached for the drive stale once the current
+    transaction commits, so no reader caches the old rows under the new
+    version."""
+
+    def bump():
+        try:
+            cache.incr(f"drive:{drive_id}:version")
+        except ValueError:
+            get_drive_version(drive_id)
+
+    transaction.on_commit(bump)
+
+
+def get_tree_etag(drive_id: UUID, version: int, key: str, user_id: UUID) -> str:
+    """Strong ETag for a rendered payload as one user sees it.
+
+    Tying it to the user means a tag only matches for someone who has been
+    served that version, and member changes bump the version, so a match
+    needs no access check.
+    """
+
+    digest = hashlib.sha1(f"{drive_id}:{version}:{key}:{user_id}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def get_tree_payload(
+    drive_id: UUID, version: int, key: str, build: Callable[[], Any]
+) -> Any:
+    """A rendered drive or folder detail, cached under the drive's version.
+
+    `key` names what was rendered (object and depth); entries of older
+    versions are never read again and expire on their own.
+    """
+
+    key = f"drive:{drive_id}:v{version}:{key}"
+    payload = cache.get(key)
+    if payload is None:
+        payload = build()
+        cache.set(key, payload, TREE_TIMEOUT)
+    return payload
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandParser
+from storage.models import Object
+
+
+class Command(BaseCommand):
+    help = "Recompute folder sizes from the files they contain"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--drive", help="Only reconcile the drive with this uid", default=None
+        )
+
+    def handle(self, *args, **options) -> None:
+
+        fixed = Object.objects.reconcile_sizes(options["drive"])
+        self.stdout.write(self.style.SUCCESS(f"{fixed} folder size(s) corrected"))
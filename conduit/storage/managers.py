@@ -0,0 +1,360 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from django.db import connection, models
+from django.db.models import (
+    BooleanField,
+    Count,
+    ExpressionWrapper,
+    F,
+    Func,
+    IntegerField,
+    Prefetch,
+    Q,
+    QuerySet,
+)
+from django.db.models.query import RawQuerySet
+
+# Folders whose content is more than this percentage of directories get those
+# directories expanded in detail views.
+DIRECTORY_SPREAD = 30
+
+# Walks the `content` links down from one object and keeps the files (nodes
+# with nothing under them that are not empty folders), each with its path
+# relative to (and including) the start. Unordered, rows come out level by level
+# as the walk finds them.
+SUBTREE_FILES_SQL = """
+WITH RECURSIVE subtree(uid, relative_path, trail) AS (
+    SELECT o.uid, o.name::text, ARRAY[o.uid]
+    FROM {object} o
+    WHERE o.uid = %s
+    UNION ALL
+    SELECT child.uid, s.relative_path || '/' || child.name, s.trail || child.uid
+    FROM subtree s
+    JOIN {content} c ON c.from_object_id = s.uid
+    JOIN {object} child ON child.uid = c.to_object_id
+    WHERE NOT child.uid = ANY(s.trail)
+)
+SELECT {columns}
+FROM subtree s
+JOIN {object} o ON o.uid = s.uid
+WHERE NOT EXISTS (SELECT 1 FROM {content} c WHERE c.from_object_id = s.uid)
+AND NOT o.is_directory
+{order_by}
+"""
+
+# Finds which nodes of an upload trie already exist, walking down by name from
+# the root (or a resource folder) one level per iteration, all in one query.
+RESOLVE_PATHS_SQL = """
+WITH RECURSIVE trie(key, parent_key, name) AS (
+    SELECT * FROM unnest(%s::text[], %s::text[], %s::text[])
+),
+found(key, uid) AS (
+    SELECT t.key, o.uid
+    FROM trie t
+    JOIN {object} o ON o.drive_id = %s AND o.name = t.name AND NOT o.is_deleted
+        AND (o.parent_id = %s::uuid OR (%s::uuid IS NULL AND o.parent_id IS NULL))
+    WHERE t.parent_key IS NULL
+    UNION ALL
+    SELECT t.key, o.uid
+    FROM found f
+    JOIN trie t ON t.parent_key = f.key
+    JOIN {object} o ON o.parent_id = f.uid AND o.name = t.name AND NOT o.is_deleted
+)
+SELECT o.*, f.key AS trie_key
+FROM found f
+JOIN {object} o ON o.uid = f.uid
+"""
+
+# Folder sizes rebuilt from the live files under them: every file adds its size
+# to each entry of its ancestor chain, and folders with no files (empty ones
+# included) drop to 0. Deleted subtrees are left to their purge.
+RECONCILE_SIZES_SQL = """
+WITH totals AS (
+    SELECT a.uid, SUM(COALESCE(f.size, 0)) AS size
+    FROM {object} f
+    CROSS JOIN LATERAL unnest(f.ancestors) AS a(uid)
+    WHERE NOT EXISTS (SELECT 1 FROM {object} c WHERE c.parent_id = f.uid)
+    AND NOT f.is_directory AND NOT f.is_deleted
+    {files_in_drive}
+    GROUP BY a.uid
+),
+folders AS (
+    SELECT d.uid, COALESCE(t.size, 0) AS size
+    FROM {object} d
+    LEFT JOIN totals t ON t.uid = d.uid
+    WHERE (d.is_directory OR t.uid IS NOT NULL) AND NOT d.is_deleted
+    {folders_in_drive}
+)
+UPDATE {object} o
+SET size = folders.size
+FROM folders
+WHERE o.uid = folders.uid AND o.size IS DISTINCT FROM folders.size
+"""
+
+
+class DriveQuerySet(QuerySet):
+    def accessible_ids(self, user: models.Model) -> QuerySet:
+        """Ids of the drives `user` owns or is a member of.
+
+        A UNION of two index lookups (the owner column and the members
+        table), so nothing is joined row by row and no DISTINCT is needed.
+        """
+
+        owned = self.model.objects.filter(owner=user).order_by().values("pk")
+        shared = (
+            self.model.members.through.objects.filter(user=user)
+            .order_by()
+            .values("drive_id")
+        )
+        return owned.union(shared)
+
+    def accessible_to(self, user: models.Model) -> QuerySet:
+        return self.filter(pk__in=self.accessible_ids(user))
+
+    def with_root_spread(self) -> QuerySet:
+        """Annotate how many objects sit at each drive's top level, how many
+        of them are directories, and whether that share is over
+        DIRECTORY_SPREAD, counted in the database over every root (not only
+        the ones a detail view loads)."""
+
+        roots = Q(storage_object__parent__isnull=True, storage_object__is_deleted=False)
+        return self.annotate(
+            root_count=Count("storage_object", filter=roots),
+            root_directory_count=Count(
+                "storage_object", filter=roots & Q(storage_object__is_directory=True)
+            ),
+        ).annotate(
+            expands_directories=ExpressionWrapper(
+                Q(root_directory_count__gt=F("root_count") * DIRECTORY_SPREAD / 100.0),
+                output_field=BooleanField(),
+            )
+        )
+
+
+class ObjectQuerySet(QuerySet):
+    def with_depth(self) -> QuerySet:
+        """Annotate each object with its depth in the folder tree (roots are 0)"""
+        return self.annotate(
+            depth=Func(
+                F("ancestors"), function="cardinality", output_field=IntegerField()
+            )
+        )
+
+    def descendants_of(self, obj: models.Model) -> QuerySet:
+        """Every object below `obj`, resolved through the ancestors index"""
+        return self.filter(drive_id=obj.drive_id, ancestors__contains=[obj.pk])
+
+    def with_directory_spread(self) -> QuerySet:
+        """Annotate how many children each object has, how many of them are
+        directories, and whether that share is over DIRECTORY_SPREAD.
+
+        Counted in the database, so a folder's children are never loaded
+        just to make the call, and empty folders simply do not expand.
+        """
+
+        return self.annotate(
+            content_count=Count("children"),
+            directory_count=Count("children", filter=Q(children__is_directory=True)),
+        ).annotate(
+            expands_directories=ExpressionWrapper(
+                Q(directory_count__gt=F("content_count") * DIRECTORY_SPREAD / 100.0),
+                output_field=BooleanField(),
+            )
+        )
+
+    def with_content(self, depth: int = 1, limit: int = 100) -> QuerySet:
+        """Load the first `limit` children of each object, `depth` levels down.
+
+        Every level is one query covering all folders of the previous level
+        (a sliced prefetch, so each parent gets its own first page), and each
+        loaded object carries its `with_directory_spread` counts. Children
+        land on `.page`, newest first like the listings.
+        """
+
+        children = self.model.objects.with_directory_spread().order_by(
+            "-created_at", "-uid"
+        )
+        return self.with_directory_spread().prefetch_related(
+            *(
+                Prefetch(
+                    "__".join(["page"] * level + ["children"]),
+                    queryset=children[:limit],
+                    to_attr="page",
+                )
+                for level in range(depth)
+            )
+        )
+
+    def ancestors_of(self, obj: models.Model) -> QuerySet:
+        """Every folder above `obj`, ordered from the root down"""
+        return (
+            self.filter(pk__in=obj.ancestors).with_depth().order_by("depth")
+            if obj.ancestors
+            else self.none()
+        )
+
+
+class ObjectManager(models.Manager.from_queryset(ObjectQuerySet)):
+    """Live objects only; `Object.all_objects` still sees deleted ones"""
+
+    def get_queryset(self) -> QuerySet:
+        return super().get_queryset().filter(is_deleted=False)
+
+    def mark_deleted(self, obj: models.Model) -> int:
+        """Hide `obj` and everything under it in two statements.
+
+        One UPDATE flags the subtree and detaches it, making `obj` the root
+        of its own (deleted) tree, so the row never counts as a live root
+        that could clash with one of the same name. Its folder link is then
+        dropped, so nothing live counts or walks into it. Returns the number
+        of objects hidden.
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {self.model._meta.db_table}
+                SET is_deleted = true,
+                    updated_at = now(),
+                    parent_id = CASE WHEN uid = %s THEN NULL ELSE parent_id END,
+                    ancestors = CASE WHEN uid = %s THEN '{{}}'::uuid[]
+                        ELSE ancestors[array_position(ancestors, %s::uuid):] END
+                WHERE drive_id = %s AND (uid = %s OR ancestors @> ARRAY[%s::uuid])
+                """,
+                [str(obj.pk)] * 3 + [str(obj.drive_id)] + [str(obj.pk)] * 2,
+            )
+            hidden = cursor.rowcount
+
+        # removed without the m2m signal: the rows are already detached
+        self.model.content.through.objects.filter(to_object_id=obj.pk).delete()
+        return hidden
+
+    def subtree_files(self, obj: models.Model) -> RawQuerySet:
+        """Every file under `obj` in one round trip.
+
+        Each row carries a `relative_path` that starts at `obj`'s own name,
+        which is the layout a folder download is rebuilt with.
+        """
+
+        return self.raw(self._subtree_files_sql("o.*, s.relative_path"), [str(obj.pk)])
+
+    def iter_subtree_files(
+        self, obj: models.Model, chunk_size: int = 2000
+    ) -> Iterator[List[Tuple[UUID, str, str]]]:
+        """Same walk as `subtree_files`, read through a server-side cursor.
+
+        Yields chunks of (uid, path, relative_path) so callers can start
+        sending results before the whole subtree has been read; they come in
+        walk order, as sorting them would read the whole subtree first.
+        """
+
+        sql = self._subtree_files_sql("o.uid, o.path, s.relative_path", ordered=False)
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(sql, [str(obj.pk)])
+            while rows := cursor.fetchmany(chunk_size):
+                yield rows
+
+    def reconcile_sizes(self, drive_id: Optional[UUID] = None) -> int:
+        """Recompute folder sizes from their files in one statement.
+
+        Returns the number of folders whose stored size had drifted.
+        """
+
+        params = [str(drive_id)] * 2 if drive_id else []
+        sql = RECONCILE_SIZES_SQL.format(
+            object=self.model._meta.db_table,
+            files_in_drive="AND f.drive_id = %s" if drive_id else "",
+            folders_in_drive="AND d.drive_id = %s" if drive_id else "",
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def resolve_paths(
+        self,
+        drive_id: UUID,
+        root: Optional[UUID],
+        paths: Iterable[Tuple[str, ...]],
+    ) -> Dict[Tuple[str, ...], models.Model]:
+        """The existing objects of a set of paths under `root` (the drive's
+        top level when None), keyed by path, in one round trip however deep
+        the paths go. Paths that do not exist yet are left out."""
+
+        paths = list(paths)
+        keys = ["/".join(path) for path in paths]
+        parent_keys = ["/".join(path[:-1]) or None for path in paths]
+        names = [path[-1] for path in paths]
+
+        root = str(root) if root else None
+        sql = RESOLVE_PATHS_SQL.format(object=self.model._meta.db_table)
+        params = [keys, parent_keys, names, str(drive_id), root, root]
+        return {tuple(obj.trie_key.split("/")): obj for obj in self.raw(sql, params)}
+
+    def lock_names(
+        self, drive_id: UUID, names: Iterable[Tuple[Optional[UUID], str]]
+    ) -> None:
+        """Take a transaction-scoped advisory lock on each name about to be
+        created, keyed by (drive, parent folder, name); None is the top level.
+
+        Ingests that create the same node wait for each other, anything else
+        in the drive (new names in the same folders included) goes ahead.
+        Keys are locked in one sorted pass so two overlapping ingests cannot
+        deadlock.
+        """
+
+        keys = sorted({f"{drive_id}:{parent or ''}:{name}" for parent, name in names})
+        if not keys:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT pg_advisory_xact_lock(hashtextextended(k.key, 0))
+                FROM unnest(%s::text[]) WITH ORDINALITY AS k(key, n)
+                ORDER BY k.n
+                """,
+                [keys],
+            )
+
+    def _subtree_files_sql(self, columns: str, ordered: bool = True) -> str:
+        return SUBTREE_FILES_SQL.format(
+            columns=columns,
+            order_by="ORDER BY s.relative_path" if ordered else "",
+            object=self.model._meta.db_table,
+            content=self.model.content.through._meta.db_table,
+        )
+
+    def rebase(self, nodes: Iterable[UUID], ancestors: List[UUID]) -> None:
+        """Hang `nodes` under the `ancestors` chain (the last one becomes their
+        parent) and rewrite their subtrees.
+
+        Descendants keep the part of their chain below the moved node and get
+        the new prefix in front of it, so a move costs one statement per moved
+        node no matter how big its subtree is.
+        """
+
+        parent = ancestors[-1] if ancestors else None
+        moved = list(
+            self.filter(pk__in=list(nodes))
+            .exclude(ancestors=ancestors, parent_id=parent)
+            .values_list("pk", flat=True)
+        )
+        if not moved:
+            return
+
+        self.filter(pk__in=moved).update(ancestors=ancestors, parent_id=parent)
+
+        prefix = [str(uid) for uid in ancestors]
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            for node in moved:
+                cursor.execute(
+                    f"""
+                    UPDATE {table}
+                    SET ancestors = %s::uuid[]
+                        || ancestors[array_position(ancestors, %s::uuid):]
+                    WHERE ancestors @> ARRAY[%s::uuid]
+                    """,
+                    [prefix, str(node), str(node)],
+                )
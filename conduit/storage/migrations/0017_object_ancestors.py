@@ -0,0 +1,54 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:26
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+# Walk the existing `content` links top-down and store every node's chain of
+# ancestors. Cycles are cut off so a bad row cannot make the walk run forever.
+BACKFILL_ANCESTORS = """
+WITH RECURSIVE tree(uid, ancestors) AS (
+    SELECT o.uid, ARRAY[]::uuid[]
+    FROM storage_object o
+    WHERE NOT EXISTS (
+        SELECT 1 FROM storage_object_content c WHERE c.to_object_id = o.uid
+    )
+    UNION ALL
+    SELECT c.to_object_id, t.ancestors || c.from_object_id
+    FROM storage_object_content c
+    JOIN tree t ON c.from_object_id = t.uid
+    WHERE NOT c.to_object_id = ANY(t.ancestors || t.uid)
+)
+UPDATE storage_object o
+SET ancestors = tree.ancestors
+FROM tree
+WHERE o.uid = tree.uid
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0016_alter_drive_size_alter_drive_used"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="object",
+            name="ancestors",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.UUIDField(),
+                blank=True,
+                default=list,
+                size=None,
+                verbose_name="Ancestor folders, root first",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="object",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["ancestors"], name="object_ancestors_gin"
+            ),
+        ),
+        migrations.RunSQL(BACKFILL_ANCESTORS, migrations.RunSQL.noop),
+    ]
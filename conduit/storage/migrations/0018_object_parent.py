@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Every `content` link names the folder an object sits in.
+BACKFILL_PARENT = """
+UPDATE storage_object o
+SET parent_id = c.from_object_id
+FROM storage_object_content c
+WHERE c.to_object_id = o.uid
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0017_object_ancestors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="object",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="children",
+                to="storage.object",
+            ),
+        ),
+        migrations.RunSQL(BACKFILL_PARENT, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:40
+
+from django.db import migrations
+
+# Every copy of a name but the oldest, shallowest first: merging a folder
+# can only create new duplicates below it.
+FIND_DUPLICATES = """
+SELECT uid, keep, is_directory, kept_directory
+FROM (
+    SELECT uid, is_directory,
+        cardinality(ancestors) AS depth,
+        row_number() OVER w AS copy,
+        first_value(uid) OVER w AS keep,
+        first_value(is_directory) OVER w AS kept_directory
+    FROM storage_object
+    WINDOW w AS (PARTITION BY drive_id, parent_id, name ORDER BY created_at, uid)
+) o
+WHERE copy > 1
+ORDER BY depth
+"""
+
+# A copy of a folder hands its children (and their chains) to the one kept.
+MERGE_FOLDER = """
+UPDATE storage_object SET parent_id = %(keep)s WHERE parent_id = %(copy)s;
+UPDATE storage_object SET ancestors = array_replace(ancestors, %(copy)s, %(keep)s)
+WHERE ancestors @> ARRAY[%(copy)s::uuid];
+UPDATE storage_object_content SET from_object_id = %(keep)s
+WHERE from_object_id = %(copy)s;
+UPDATE storage_object SET size = coalesce(size, 0) + coalesce(
+    (SELECT size FROM storage_object WHERE uid = %(copy)s), 0
+) WHERE uid = %(keep)s;
+"""
+
+# A copy of a file stands for the same S3 key: it no longer counts above it.
+DROP_FILE = """
+UPDATE storage_object SET size = coalesce(size, 0) - coalesce(
+    (SELECT size FROM storage_object WHERE uid = %(copy)s), 0
+) WHERE uid IN (SELECT unnest(ancestors) FROM storage_object WHERE uid = %(copy)s);
+UPDATE storage_drive SET used = coalesce(used, 0) - coalesce(
+    (SELECT size FROM storage_object WHERE uid = %(copy)s), 0
+) WHERE uid = (SELECT drive_id FROM storage_object WHERE uid = %(copy)s);
+"""
+
+# A file and a folder cannot be merged: the younger one is renamed.
+RENAME = """
+UPDATE storage_object
+SET path = %(path)s || substr(path, length(%(old)s) + 1)
+WHERE ancestors @> ARRAY[%(copy)s::uuid];
+UPDATE storage_object SET name = %(name)s, path = %(path)s WHERE uid = %(copy)s;
+"""
+
+
+def free_name(cursor, copy):
+    cursor.execute(
+        "SELECT drive_id, parent_id, name, path, is_directory "
+        "FROM storage_object WHERE uid = %s",
+        [copy],
+    )
+    drive_id, parent_id, name, path, is_directory = cursor.fetchone()
+
+    stem, dot, ext = name.rpartition(".")
+    if is_directory or not stem:
+        stem, dot, ext = name, "", ""
+
+    taken = True
+    number = 0
+    while taken:
+        number += 1
+        candidate = f"{stem} ({number}){dot}{ext}"
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM storage_object WHERE drive_id = %s "
+            "AND parent_id IS NOT DISTINCT FROM %s AND name = %s)",
+            [drive_id, parent_id, candidate],
+        )
+        (taken,) = cursor.fetchone()
+
+    return {
+        "copy": copy,
+        "name": candidate,
+        "old": path,
+        "path": path[: len(path) - len(name)] + candidate,
+    }
+
+
+def dedupe_object_names(apps, schema_editor):
+    Object = apps.get_model("storage", "Object")
+
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(FIND_DUPLICATES)
+            duplicates = cursor.fetchall()
+            if not duplicates:
+                return
+
+            for copy, keep, is_directory, kept_directory in duplicates:
+                params = {"copy": copy, "keep": keep}
+                if is_directory != kept_directory:
+                    cursor.execute(RENAME, free_name(cursor, copy))
+                    continue
+
+                cursor.execute(MERGE_FOLDER if is_directory else DROP_FILE, params)
+                Object.objects.filter(pk=copy).delete()
+
+                # the merged children may collide in turn: look again
+                if is_directory:
+                    break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0018_object_parent"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_object_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # kept apart from the backfill and the dedupe: postgres will not alter a table that
+    # still has deferred foreign key checks pending in the same transaction
+    dependencies = [
+        ("storage", "0019_dedupe_object_names"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="object",
+            constraint=models.UniqueConstraint(
+                fields=("drive", "parent", "name"),
+                name="unique_object_name_per_directory",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0020_object_unique_object_name_per_directory"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="object",
+            index=models.Index(
+                fields=["drive", "created_at", "uid"], name="object_drive_created_uid"
+            ),
+        ),
+    ]
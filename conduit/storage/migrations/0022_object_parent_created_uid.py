@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0021_object_drive_created_uid"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="object",
+            index=models.Index(
+                fields=["parent", "created_at", "uid"], name="object_parent_created_uid"
+            ),
+        ),
+    ]
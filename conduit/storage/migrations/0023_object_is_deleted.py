@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0022_object_parent_created_uid"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="object",
+            name="unique_object_name_per_directory",
+        ),
+        migrations.AddField(
+            model_name="object",
+            name="is_deleted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddConstraint(
+            model_name="object",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_deleted", False)),
+                fields=("drive", "parent", "name"),
+                name="unique_object_name_per_directory",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
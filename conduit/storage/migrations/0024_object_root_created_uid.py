@@ -0,0 +1,21 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("storage", "0023_object_is_deleted"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="object",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False), ("parent__isnull", True)),
+                fields=["drive", "created_at", "uid"],
+                name="object_root_created_uid",
+            ),
+        ),
+    ]
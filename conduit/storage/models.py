@@ -1,12 +1,18 @@
-from typing import Dict, List, Optional
+from typing import Iterator, List, Optional
 
 from abstract.apis.aws.handlers import S3AWSHandler
 from abstract.apis.aws.types import BaseFileObject
 from abstract.models import TimestampUUIDMixin
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 from storage.choices import DriveType
 
+from .managers import DriveQuerySet, ObjectManager
+
 
 def upload_file_to_user_drive(file: "Object", filename: str) -> str:
     """Dir for upload"""
@@ -33,6 +39,8 @@ class Drive(TimestampUUIDMixin):
     members = models.ManyToManyField("users.User")
     is_active = models.BooleanField(default=True)
 
+    objects = DriveQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -57,6 +65,12 @@ class Drive(TimestampUUIDMixin):
     def __str__(self) -> str:
         return self.name
 
+    def record_usage(self, delta: float) -> None:
+        """Shift the space used by `delta` kb (negative to free space) in a
+        single atomic UPDATE, so the cost does not grow with the drive"""
+
+        Drive.objects.filter(pk=self.pk).update(used=Coalesce(F("used"), 0.0) + delta)
+
 
 class Object(TimestampUUIDMixin):
     """Represents the file or folder to be stored"""
@@ -79,6 +93,13 @@ class Object(TimestampUUIDMixin):
     content = models.ManyToManyField(
         "self", blank=True, related_name="in_directory", symmetrical=False
     )
+    parent = models.ForeignKey(
+        "self",
+        related_name="children",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
     path = models.CharField(
         _("AWS path : key"),
         default="new",
@@ -93,10 +114,53 @@ class Object(TimestampUUIDMixin):
     size = models.FloatField(
         _("Size of the file/directory (kb)"), null=True, blank=True
     )
+    ancestors = ArrayField(
+        models.UUIDField(),
+        verbose_name=_("Ancestor folders, root first"),
+        default=list,
+        blank=True,
+    )
+    # hidden right away on delete, purged from S3 and the db by a task
+    is_deleted = models.BooleanField(default=False)
+
+    objects = ObjectManager()
+    all_objects = models.Manager()
+
+    class Meta(TimestampUUIDMixin.Meta):
+        indexes = [
+            GinIndex(fields=["ancestors"], name="object_ancestors_gin"),
+            # keyset pagination of a drive's listing
+            models.Index(
+                fields=["drive", "created_at", "uid"], name="object_drive_created_uid"
+            ),
+            # a folder's content, paged the same way
+            models.Index(
+                fields=["parent", "created_at", "uid"], name="object_parent_created_uid"
+            ),
+            # the drive's top level, paged the same way
+            models.Index(
+                fields=["drive", "created_at", "uid"],
+                condition=models.Q(parent__isnull=True, is_deleted=False),
+                name="object_root_created_uid",
+            ),
+        ]
+        constraints = [
+            # roots (no parent) are unique per drive too: they share the S3 prefix
+            models.UniqueConstraint(
+                fields=["drive", "parent", "name"],
+                condition=models.Q(is_deleted=False),
+                name="unique_object_name_per_directory",
+                nulls_distinct=False,
+            )
+        ]
 
     def __str__(self) -> str:
         return self.name + " - " + self.drive.name
 
+    def get_depth(self) -> int:
+        """Number of folders above this object"""
+        return len(self.ancestors)
+
     def get_file_path(self) -> str:
         """Dir for upload"""
         return self.path + "/"
@@ -112,8 +176,8 @@ class Object(TimestampUUIDMixin):
         return full_path
 
     def get_object_download_url(self) -> List[BaseFileObject]:
-        """directory assets are recursively fetched from db,
-        while obtaining the presigned urls at the same time.
+        """directory assets are fetched from db in a single query,
+        then their presigned urls are obtained in one batch.
         return: List of FileObject types.
         """
 
@@ -126,62 +190,44 @@ class Object(TimestampUUIDMixin):
                 }
             ]
 
-        return fetch_all_folder_asset_from_db(
-            self, [], self.name if self.in_directory else None
+        leaves = list(Object.objects.subtree_files(self))
+        handler = S3AWSHandler()
+        urls = handler.get_download_presigned_urls(
+            [self.drive.name + leaf.path for leaf in leaves]
         )
 
+        return [
+            {"id": leaf.pk, "path": leaf.relative_path, "url": url}
+            for leaf, url in zip(leaves, urls)
+        ]
+
+    def iter_object_download_url(self) -> Iterator[BaseFileObject]:
+        """Lazy version of get_object_download_url for very large folders:
+        files are read and signed a chunk at a time as they are consumed.
+        """
+
+        if not self.is_directory:
+            yield from self.get_object_download_url()
+            return
+
+        handler = S3AWSHandler()
+        for rows in Object.objects.iter_subtree_files(self):
+            urls = handler.get_download_presigned_urls(
+                [self.drive.name + path for _uid, path, _relative in rows]
+            )
+            for (uid, _path, relative_path), url in zip(rows, urls):
+                yield {"id": uid, "path": relative_path, "url": url}
+
     def _get_object_download_url(self) -> str:
 
         handler = S3AWSHandler()
         return handler.get_download_presigned_url(self.drive.name + self.path)
 
-    def parse_path(self) -> List[Dict[str, str]]:
-        """Traverse the path tree and get each node name and pk"""
-        path: str = self.path
-        nodes = path.split("/")[1:]
-        object_nodes = []
-        root = None
-
-        # get the root asset
-        try:
-            root = Object.objects.get(
-                in_directory__isnull=True,
-                name=nodes[0],
-                drive__uid=str(self.drive.pk),
-            )
-        except Object.DoesNotExist:
-            raise
-
-        parent = root
-        object_nodes.append(root)
-        for idx in range(1, len(nodes)):
-
-            for obj in parent.content.all():
-                if nodes[idx] == obj.name:
-                    object_nodes.append(obj)
-                    parent = obj
-            idx += 1
-
-        return object_nodes
-
-
-def fetch_all_folder_asset_from_db(
-    asset: Object, tree: List[BaseFileObject], root: str
-) -> List[BaseFileObject]:
-
-    # recursive func to get all the contents of the folder from db...
-    content = asset.content.all()
-    if not content:
-        tree.append(
-            {
-                "id": asset.pk,
-                "path": asset.get_download_path(root),
-                "url": asset._get_object_download_url(),
-            }
-        )
-        return tree
-
-    for obj in content:
-        tree = fetch_all_folder_asset_from_db(obj, tree, root)
+    def parse_path(self) -> List["Object"]:
+        """Breadcrumb from the drive root down to this object, in one query"""
 
-    return tree
+        return list(
+            Object.objects.filter(pk__in=self.ancestors + [self.pk])
+            .with_depth()
+            .order_by("depth")
+        )
@@ -0,0 +1,110 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class CreatedCursorPagination(CursorPagination):
+    """Keyset pagination on (created_at, uid), newest first.
+
+    Each page seeks from the previous page's last row instead of counting the
+    whole listing and skipping an OFFSET, so deep pages cost the same as the
+    first one. The cursor holds the whole (created_at, uid) pair, so rows
+    created in the same instant are told apart by `uid` rather than by an
+    offset from the first of them.
+    """
+
+    ordering = ("-created_at", "-uid")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    position_separator = "|"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = self.cursor.position if self.cursor else None
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_seek(ordering, position))
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+
+        # one row past the page tells whether another follows
+        results = list(queryset[: self.page_size + 1])
+        self.page = results[: self.page_size]
+        following = (
+            self._get_position_from_instance(results[-1], self.ordering)
+            if len(results) > self.page_size
+            else None
+        )
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None, position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_seek(self, ordering, position: str) -> Q:
+        """Rows after `position` in `ordering`: a row comparison spelled out
+        field by field, with the first field also bounded on its own so the
+        seek starts from the index"""
+
+        fields = [field.lstrip("-") for field in ordering]
+        values = position.split(self.position_separator)
+        if len(values) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+
+        seek, equal = Q(), Q()
+        for order, field, value in zip(ordering, fields, values):
+            after = "lt" if order.startswith("-") else "gt"
+            seek |= equal & Q(**{f"{field}__{after}": value})
+            equal &= Q(**{field: value})
+
+        bound = "lte" if ordering[0].startswith("-") else "gte"
+        return Q(**{f"{fields[0]}__{bound}": values[0]}) & seek
+
+    def _get_position_from_instance(self, instance, ordering):
+        fields = [field.lstrip("-") for field in ordering]
+        if isinstance(instance, dict):
+            values = [instance[field] for field in fields]
+        else:
+            values = [getattr(instance, field) for field in fields]
+        return self.position_separator.join(str(value) for value in values)
+
+
+class ContentCursorPagination(CreatedCursorPagination):
+    """Same ordering for a folder's content, which is always paged"""
+
+    page_size = 100
+
+
+class CursorOptInMixin:
+    """Lists with the configured pagination unless the request sends
+    `?cursor` (empty for the first page), which switches it to keyset pages
+    whose `next` links carry the cursor on."""
+
+    cursor_pagination_class = CreatedCursorPagination
+
+    @property
+    def paginator(self):
+        if "cursor" in self.request.query_params and not hasattr(self, "_paginator"):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
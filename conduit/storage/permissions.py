@@ -1,12 +1,50 @@
+from typing import Iterable
+from uuid import UUID
+
+from django.core.cache import cache
+from django.db import transaction
 from rest_framework.permissions import BasePermission
 
+from .models import Drive
+
+MEMBERSHIP_TIMEOUT = 60 * 60
+
+
+def is_drive_member(drive_id: UUID, user_id: UUID) -> bool:
+    """One indexed EXISTS on the members table, cached per (drive, user)"""
+
+    key = f"drive:{drive_id}:member:{user_id}"
+    member = cache.get(key)
+    if member is None:
+        member = Drive.members.through.objects.filter(
+            drive_id=drive_id, user_id=user_id
+        ).exists()
+        cache.set(key, member, MEMBERSHIP_TIMEOUT)
+    return member
+
+
+def forget_drive_members(drive_id: UUID, user_ids: Iterable[UUID]) -> None:
+    """Drop cached membership answers once the change is committed"""
+
+    keys = [f"drive:{drive_id}:member:{user_id}" for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
 
 class IsDriveOwnerOrMember(BasePermission):
 
     message: str = "You do not have access to this drive"
 
     def has_object_permission(self, request, view, obj) -> bool:
-        return obj.owner == request.user or request.user in obj.members.all()
+        # answered once per drive per request, however often a view checks
+        checked = getattr(request, "_drive_access", None)
+        if checked is None:
+            checked = request._drive_access = {}
+
+        if obj.pk not in checked:
+            checked[obj.pk] = obj.owner_id == request.user.pk or is_drive_member(
+                obj.pk, request.user.pk
+            )
+        return checked[obj.pk]
 
 
 class IsDriveOwner(BasePermission):
@@ -1,11 +1,11 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.base_user import AbstractBaseUser
 from rest_framework import serializers
 
 from .models import Drive, Object
-from .utils import handle_directory_depth
+from .permissions import forget_drive_members
 
 User: AbstractBaseUser = get_user_model()
 
@@ -84,6 +84,16 @@ class DriveObjectSerializer(serializers.ModelSerializer):
 
 
 class DriveDetailSerializer(serializers.ModelSerializer):
+    """Expects a drive loaded with `DriveViewSet.get_detail_prefetches()`.
+
+    Query budget: DETAIL_QUERIES, whatever the size of the drive. One for the
+    drive (with its `with_root_spread` counts), one for the member preview,
+    one for the first page of root objects and one for the first page of
+    content of every root folder loaded. The view adds its access
+    check on top, and serves repeats from the tree cache.
+    """
+
+    DETAIL_QUERIES = 4
 
     members = serializers.SerializerMethodField()  # first three
     storage_objects = serializers.SerializerMethodField()
@@ -102,18 +112,15 @@ class DriveDetailSerializer(serializers.ModelSerializer):
         ]
 
     def get_members(self, drive: Drive) -> List[str]:
-        return drive.members.values_list("tag", flat=True)[:3]
+        return [member.tag for member in drive.member_preview]
 
     def get_storage_objects(self, drive: Drive) -> Dict[str, Any]:
-        objects = drive.storage_object.filter(in_directory__isnull=True)
-        return DriveObjectSerializer(objects, many=True).data
+        return DriveObjectSerializer(drive.roots, many=True).data
 
     def get_directories(self, drive: Drive):
-        objects = drive.storage_object.filter(in_directory__isnull=True)
-        if objects:
-            dirs = handle_directory_depth(objects)
-            if dirs:
-                return ObjectDetailSerializer(dirs, many=True).data
+        if drive.expands_directories:
+            dirs = [obj for obj in drive.roots if obj.is_directory]
+            return ObjectDetailSerializer(dirs, many=True).data
 
         return None
 
@@ -131,6 +138,7 @@ class AddDriveMemberSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         instance.members.add(*validated_data["members"])
+        forget_drive_members(instance.pk, [m.pk for m in validated_data["members"]])
         return instance
 
 
@@ -144,8 +152,12 @@ class DriveMemberSerializer(serializers.ModelSerializer):
 
 
 class ObjectDetailSerializer(serializers.ModelSerializer):
+    """Expects objects from `Object.objects.with_content()`: `content` is the
+    first page of children and `directories` expands the folders in it for as
+    many levels as were loaded."""
 
     content = serializers.SerializerMethodField()
+    content_count = serializers.IntegerField(read_only=True)
     directories = serializers.SerializerMethodField()
 
     class Meta:
@@ -155,23 +167,26 @@ class ObjectDetailSerializer(serializers.ModelSerializer):
             "name",
             "size",
             "content",
+            "content_count",
             "metadata",
             "path",
             "directories",
         ]
 
-    def get_content(self, object: Object) -> List[Dict[str, Any]]:
+    def get_content(self, object: Object) -> Optional[List[Dict[str, Any]]]:
+
+        if not hasattr(object, "page"):
+            return None
+        return DriveObjectSerializer(object.page, many=True).data
 
-        objects = object.content.all()
-        return DriveObjectSerializer(objects, many=True).data
+    def get_directories(self, object: Object) -> Optional[List[Dict[str, Any]]]:
 
-    def get_directories(self, object: Object) -> List[Dict[str, Any]]:
-        # TODO: There needs to be a limit on the number of objects that this routine is run for...Ideally we do not want this to be done
-        # for really large folders, so monitor latency and find that threshold that this starts to become annoying...
-        objects = object.content.all()
-        dirs = handle_directory_depth(objects)
+        if not object.expands_directories:
+            return None
 
-        if dirs:
+        dirs = [obj for obj in getattr(object, "page", []) if obj.is_directory]
+        # folders one level past the loaded depth have no page to show
+        if dirs and hasattr(dirs[0], "page"):
             return ObjectDetailSerializer(dirs, many=True).data
 
         return None
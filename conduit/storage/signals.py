@@ -0,0 +1,45 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .models import Object
+
+
+@receiver(m2m_changed, sender=Object.content.through)
+def sync_object_ancestors(
+    sender, instance: Object, action: str, reverse: bool, pk_set, **kwargs
+):
+    """Keep `Object.ancestors` in step with the `content` links"""
+
+    if action == "pre_clear" and not reverse:
+        # the links are gone by post_clear, so note whom they held
+        instance._cleared_content = list(instance.content.values_list("pk", flat=True))
+        return
+
+    if action == "post_clear":
+        if reverse:
+            instance.ancestors = []
+            cleared = [instance.pk]
+        else:
+            cleared = instance.__dict__.pop("_cleared_content", [])
+        Object.objects.rebase(cleared, [])
+        return
+
+    if action not in ("post_add", "post_remove"):
+        return
+
+    if reverse:
+        # object.in_directory.add(folder): the instance is the child
+        parents = Object.objects.filter(pk__in=pk_set or [])
+        parent = parents.first() if action == "post_add" else None
+        instance.ancestors = parent.ancestors + [parent.pk] if parent else []
+        Object.objects.rebase([instance.pk], instance.ancestors)
+        return
+
+    ancestors = []
+    if action == "post_add":
+        # the folder in memory may predate its own move, so read the stored chain
+        stored = Object.objects.filter(pk=instance.pk).values_list(
+            "ancestors", flat=True
+        )
+        ancestors = stored.first() + [instance.pk]
+    Object.objects.rebase(pk_set or [], ancestors)
@@ -0,0 +1,119 @@
+import logging
+from datetime import timedelta
+from typing import List
+
+from abstract.apis.aws.handlers import DELETE_BATCH_SIZE, S3AWSHandler
+from celery import shared_task
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Drive, Object
+
+logger = logging.getLogger("storage")
+
+# A purge S3 partly refused runs again after 1, 2, 4... minutes.
+PURGE_RETRIES = 5
+PURGE_RETRY_DELAY = 60
+# Deleted objects still there this long after their delete are purged again.
+PURGE_STRANDED = timedelta(hours=1)
+
+
+@shared_task(name="Verify Drive Usage")
+def verify_drive_usage() -> int:
+    """Correct drives whose incrementally kept `used` drifted from the sum of
+    their files. The fix is computed inside the UPDATE so uploads landing
+    meanwhile are not lost."""
+
+    # files only, as reconcile_sizes counts them; deleted files count until
+    # purged, as their space is freed by the purge
+    files = Object.all_objects.filter(drive=OuterRef("pk"), is_directory=False).exclude(
+        Exists(Object.all_objects.filter(parent=OuterRef("pk")))
+    )
+    actual = Coalesce(
+        Subquery(
+            files.order_by()
+            .values("drive")
+            .annotate(total=Sum(Coalesce("size", 0.0)))
+            .values("total")
+        ),
+        0.0,
+    )
+
+    drifted = list(
+        Drive.objects.annotate(actual=actual)
+        .filter(~Q(used=actual) | Q(used__isnull=True))
+        .values_list("pk", flat=True)
+    )
+    if drifted:
+        Drive.objects.filter(pk__in=drifted).update(used=actual)
+        logger.warning(f"Corrected usage drift on {len(drifted)} drive(s)")
+
+    return len(drifted)
+
+
+@shared_task(name="Purge Deleted Objects")
+def purge_deleted_objects(object_id: str, attempt: int = 0) -> int:
+    """Remove a deleted object's files from S3, then its rows, then give its
+    space back to the drive in one update.
+
+    Files are read and deleted a DeleteObjects batch at a time. If S3
+    refuses any key the object is left in place (still hidden) and the
+    purge is queued again with a growing delay, PURGE_RETRIES times;
+    `requeue_stranded_purges` picks up whatever is left after that.
+    Returns the number of files removed.
+    """
+
+    root = (
+        Object.all_objects.select_related("drive")
+        .filter(pk=object_id, is_deleted=True)
+        .first()
+    )
+    if not root:
+        return 0
+    handler = S3AWSHandler()
+
+    purged = 0
+    failed: List[str] = []
+    for rows in Object.objects.iter_subtree_files(root, DELETE_BATCH_SIZE):
+        keys = {root.drive.name + path: uid for uid, path, _ in rows}
+        failed += handler.delete_objects(list(keys))
+        done = [uid for key, uid in keys.items() if key not in failed]
+        Object.all_objects.filter(pk__in=done).exclude(pk=root.pk).delete()
+        purged += len(done)
+
+    if failed:
+        logger.error(f"Purge of {object_id} left {len(failed)} file(s) in S3")
+        if attempt < PURGE_RETRIES:
+            purge_deleted_objects.apply_async(
+                (object_id, attempt + 1), countdown=PURGE_RETRY_DELAY * 2**attempt
+            )
+        return purged
+
+    with transaction.atomic():
+        root.drive.record_usage(-(root.size or 0.0))
+        root.delete()
+
+    return purged
+
+
+@shared_task(name="Requeue Stranded Purges")
+def requeue_stranded_purges() -> int:
+    """Queue the purge again for deleted objects still around PURGE_STRANDED
+    after their delete, e.g. once S3 kept refusing past the retries or a
+    worker died mid-purge; returns the number queued"""
+
+    cutoff = timezone.now() - PURGE_STRANDED
+    stranded = Object.all_objects.filter(
+        is_deleted=True, parent__isnull=True, updated_at__lt=cutoff
+    ).values_list("pk", flat=True)
+
+    queued = 0
+    for uid in stranded:
+        purge_deleted_objects.delay(str(uid))
+        queued += 1
+
+    if queued:
+        logger.warning(f"Queued {queued} stranded purge(s) again")
+    return queued
@@ -0,0 +1,67 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from notifications.models import DriveNotification
+from share.models import Share
+from storage.models import Drive, Object
+
+
+@pytest.fixture
+def user(user_factory):
+    return user_factory.create()
+
+
+@pytest.fixture
+def drives(user, drive_factory, user_factory):
+    """One drive the user owns (and is listed as a member of), one shared with
+    them, and one they have nothing to do with"""
+
+    owned = drive_factory.create(owner=user, members=[user])
+    shared = drive_factory.create(owner=user_factory.create(), members=[user])
+    drive_factory.create(owner=user_factory.create())
+    return owned, shared
+
+
+@pytest.mark.django_db
+class TestDriveAccess:
+    def test_accessible_drives_are_owned_or_shared(self, user, drives):
+
+        owned, shared = drives
+        accessible = {d.pk for d in Drive.objects.accessible_to(user)}
+
+        personal = user.user_drive.get(type="personal")
+        assert accessible == {personal.pk, owned.pk, shared.pk}
+
+    def test_listing_does_not_scale_with_files(self, user, drives, as_user):
+
+        client = as_user(user)
+        with CaptureQueriesContext(connection) as before:
+            first = client.get("/api/v1/drives/").json()
+
+        for drive in drives:
+            for i in range(20):
+                Object.objects.create(drive=drive, name=f"{i}.txt")
+        with CaptureQueriesContext(connection) as after:
+            second = client.get("/api/v1/drives/").json()
+
+        assert len(first) == len(second) == len(drives) + 1  # plus personal drive
+        assert len(before) == len(after)
+        assert not any("DISTINCT" in q["sql"] for q in after)
+        assert not any('"storage_object"' in q["sql"] for q in after)
+
+    def test_notifications_come_from_accessible_drives_once(
+        self, user, drives, user_factory, as_user
+    ):
+
+        stranger = user_factory.create()
+        for drive in Drive.objects.all():
+            share = Share.objects.create(author=stranger, drive=drive)
+            DriveNotification.objects.create(
+                publisher=stranger, drive=drive, share=share
+            )
+
+        response = as_user(user).get("/api/v1/notifications/")
+
+        assert response.status_code == 200
+        # own personal drive, the owned drive and the shared one
+        assert len(response.json()) == 3
@@ -0,0 +1,158 @@
+import pytest
+from django.core.cache import cache
+from storage.cache import bump_drive_version, get_breadcrumbs
+from storage.models import Object
+
+
+@pytest.mark.django_db
+class TestObjectHierarchy:
+    def test_ancestors_follow_content_links(self, create_tree):
+
+        pot = Object.objects.get(name="pot.png")
+        chain = [obj.name for obj in Object.objects.ancestors_of(pot)]
+
+        assert chain == ["home", "kitchen", "cooker"]
+        assert pot.get_depth() == 3
+        assert create_tree.get_depth() == 0
+
+    def test_descendants_are_resolved_in_one_query(
+        self, create_tree, tree_nodes, django_assert_num_queries
+    ):
+
+        with django_assert_num_queries(1):
+            names = set(
+                Object.objects.descendants_of(create_tree).values_list(
+                    "name", flat=True
+                )
+            )
+
+        assert names == set(tree_nodes) - {"home"}
+
+    def test_depth_annotation(self, create_tree):
+
+        depths = dict(
+            Object.objects.with_depth()
+            .filter(drive=create_tree.drive)
+            .values_list("name", "depth")
+        )
+
+        assert depths["home"] == 0
+        assert depths["living"] == 1
+        assert depths["table_top"] == 2
+        assert depths["remote.jpg"] == 3
+
+    def test_moving_a_folder_rewrites_its_subtree(self, create_tree):
+
+        living = Object.objects.get(name="living")
+        kitchen = Object.objects.get(name="kitchen")
+        fridge = Object.objects.get(name="fridge")
+
+        kitchen.content.remove(fridge)
+        assert Object.objects.get(name="fruits.json").ancestors == [fridge.pk]
+
+        living.content.add(fridge)
+        fruits = Object.objects.get(name="fruits.json")
+        chain = [obj.name for obj in Object.objects.ancestors_of(fruits)]
+
+        assert chain == ["home", "living", "fridge"]
+        assert fruits.get_depth() == 3
+
+    def test_clearing_a_folder_detaches_its_content(self, create_tree):
+
+        living = Object.objects.get(name="living")
+
+        living.content.clear()
+
+        table_top = Object.objects.get(name="table_top")
+        remote = Object.objects.get(name="remote.jpg")
+        assert (table_top.parent_id, table_top.ancestors) == (None, [])
+        assert remote.ancestors == [table_top.pk]
+
+    def test_clearing_the_folders_of_an_object_detaches_it(self, create_tree):
+
+        fridge = Object.objects.get(name="fridge")
+
+        fridge.in_directory.clear()
+
+        fridge.refresh_from_db()
+        assert (fridge.parent_id, fridge.ancestors) == (None, [])
+        assert Object.objects.get(name="fruits.json").ancestors == [fridge.pk]
+
+
+@pytest.mark.django_db
+class TestBreadcrumbs:
+    def test_path_is_resolved_in_one_query(
+        self, create_tree, django_assert_num_queries
+    ):
+
+        remote = Object.objects.get(name="remote.jpg")
+        with django_assert_num_queries(1):
+            nodes = remote.parse_path()
+
+        assert [obj.name for obj in nodes] == [
+            "home",
+            "living",
+            "table_top",
+            "remote.jpg",
+        ]
+
+    def test_same_named_folders_in_other_roots_are_not_mixed_up(
+        self, create_tree, object_factory
+    ):
+
+        other_root = object_factory.create(drive=create_tree.drive, name="garage")
+        decoy = object_factory.create(drive=create_tree.drive, name="living")
+        other_root.content.add(decoy)
+
+        table_top = Object.objects.get(name="table_top")
+        assert [obj.pk for obj in table_top.parse_path()][:2] == [
+            create_tree.pk,
+            Object.objects.get(name="living", parent=create_tree).pk,
+        ]
+
+    def test_breadcrumbs_are_cached_until_the_object_moves(
+        self, create_tree, django_assert_num_queries
+    ):
+
+        cache.clear()
+        fruits = Object.objects.get(name="fruits.json")
+        crumbs = get_breadcrumbs(fruits)
+        assert [node["name"] for node in crumbs] == [
+            "home",
+            "kitchen",
+            "fridge",
+            "fruits.json",
+        ]
+
+        with django_assert_num_queries(0):
+            assert get_breadcrumbs(fruits) == crumbs
+
+        fridge = Object.objects.get(name="fridge")
+        Object.objects.get(name="living").content.add(fridge)
+        fruits.refresh_from_db()
+
+        assert [node["name"] for node in get_breadcrumbs(fruits)] == [
+            "home",
+            "living",
+            "fridge",
+            "fruits.json",
+        ]
+
+    def test_breadcrumbs_follow_a_renamed_folder(
+        self, create_tree, django_capture_on_commit_callbacks
+    ):
+
+        cache.clear()
+        fruits = Object.objects.get(name="fruits.json")
+        get_breadcrumbs(fruits)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Object.objects.filter(name="kitchen").update(name="pantry")
+            bump_drive_version(fruits.drive_id)
+
+        assert [node["name"] for node in get_breadcrumbs(fruits)] == [
+            "home",
+            "pantry",
+            "fridge",
+            "fruits.json",
+        ]
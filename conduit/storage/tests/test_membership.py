@@ -0,0 +1,71 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from storage.permissions import is_drive_member
+
+from .test_storage import build_object_endpoint
+
+
+def membership_queries(queries):
+    return [q["sql"] for q in queries if "storage_drive_members" in q["sql"]]
+
+
+@pytest.mark.django_db
+class TestDriveMembership:
+    def test_membership_is_checked_once_then_cached(self, drive, user_factory, as_user):
+
+        member = user_factory.create()
+        drive.members.add(member)
+        client = as_user(member)
+        url = build_object_endpoint(str(drive.uid))
+
+        with CaptureQueriesContext(connection) as cold:
+            assert client.get(url).status_code == 200
+        with CaptureQueriesContext(connection) as warm:
+            assert client.get(url).status_code == 200
+
+        assert len(membership_queries(cold)) == 1
+        assert "LIMIT 1" in membership_queries(cold)[0]
+        assert not membership_queries(warm)
+
+    def test_owner_needs_no_membership_lookup(self, drive, as_user):
+
+        with CaptureQueriesContext(connection) as queries:
+            response = as_user(drive.owner).get(build_object_endpoint(str(drive.uid)))
+
+        assert response.status_code == 200
+        assert not membership_queries(queries)
+
+    def test_added_member_gets_access_straight_away(
+        self, drive, user_factory, django_capture_on_commit_callbacks, as_user
+    ):
+
+        user = user_factory.create()
+        url = build_object_endpoint(str(drive.uid))
+        assert as_user(user).get(url).status_code == 403
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = as_user(drive.owner).post(
+                f"/api/v1/drives/{drive.uid}/members/", {"members": [str(user.uid)]}
+            )
+
+        assert response.status_code == 200
+        assert as_user(user).get(url).status_code == 200
+
+    def test_removed_member_loses_access_straight_away(
+        self, drive, user_factory, django_capture_on_commit_callbacks, as_user
+    ):
+
+        member = user_factory.create()
+        drive.members.add(member)
+        url = build_object_endpoint(str(drive.uid))
+        assert as_user(member).get(url).status_code == 200
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = as_user(drive.owner).delete(
+                f"/api/v1/drives/{drive.uid}/members/{member.uid}/"
+            )
+
+        assert response.status_code == 204
+        assert not is_drive_member(drive.pk, member.pk)
+        assert as_user(member).get(url).status_code == 403
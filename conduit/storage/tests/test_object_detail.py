@@ -0,0 +1,165 @@
+from unittest.mock import patch
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from storage.models import Object
+from storage.serializers import DriveDetailSerializer
+from storage.views import DriveViewSet
+
+from .test_storage import build_object_endpoint
+
+
+def build_folder(drive, name: str, width: int, levels: int, parent=None) -> Object:
+    """A folder holding `width` sub folders per level and two files in each"""
+
+    folder = Object.objects.create(
+        drive=drive, name=name, path=f"/{name}", is_directory=True
+    )
+    if parent:
+        parent.content.add(folder)
+    if levels:
+        for i in range(width):
+            build_folder(drive, f"{name}-{i}", width, levels - 1, folder)
+    else:
+        for i in range(2):
+            folder.content.add(
+                Object.objects.create(drive=drive, name=f"{name}-{i}.txt", path="/")
+            )
+    return folder
+
+
+@pytest.mark.django_db
+class TestObjectDetail:
+    def test_depth_bounds_expansion(self, drive, owner_client):
+
+        root = build_folder(drive, "root", width=3, levels=2)
+        url = build_object_endpoint(str(drive.uid), str(root.uid))
+
+        shallow = owner_client.get(url + "?depth=1").json()
+        deep = owner_client.get(url + "?depth=2").json()
+
+        assert shallow["content_count"] == 3
+        assert len(shallow["content"]) == 3
+        assert shallow["directories"] is None
+        assert [len(d["content"]) for d in deep["directories"]] == [3, 3, 3]
+        assert all(d["directories"] is None for d in deep["directories"])
+
+    def test_query_count_does_not_grow_with_the_tree(self, drive, owner_client):
+
+        narrow = build_folder(drive, "narrow", width=2, levels=3)
+        wide = build_folder(drive, "wide", width=4, levels=3)
+
+        counts = []
+        for folder in (narrow, wide):
+            url = build_object_endpoint(str(drive.uid), str(folder.uid))
+            with CaptureQueriesContext(connection) as queries:
+                response = owner_client.get(url + "?depth=4")
+            assert response.status_code == 200
+            counts.append(len(queries))
+
+        assert counts[0] == counts[1]
+
+    def test_content_is_paged_per_folder(self, drive, owner_client):
+
+        root = build_folder(drive, "root", width=4, levels=1)
+        url = build_object_endpoint(str(drive.uid), str(root.uid))
+
+        data = owner_client.get(url + "?depth=2&page_size=2").json()
+
+        assert data["content_count"] == 4
+        assert len(data["content"]) == 2
+        assert all(len(d["content"]) == 2 for d in data["directories"])
+
+    def test_content_pages_cover_the_folder(self, drive, owner_client):
+
+        root = build_folder(drive, "root", width=5, levels=1)
+        url = build_object_endpoint(str(drive.uid), str(root.uid))
+        url += "get-content/?page_size=2"
+
+        uids = []
+        while url:
+            page = owner_client.get(url).json()
+            uids += [obj["uid"] for obj in page["results"]]
+            url = page["next"]
+
+        assert sorted(uids) == sorted(str(o.uid) for o in root.content.all())
+
+    @pytest.mark.parametrize("depth", ["0", "6", "all"])
+    def test_invalid_depth_is_rejected(self, drive, owner_client, depth):
+
+        root = build_folder(drive, "root", width=1, levels=1)
+        url = build_object_endpoint(str(drive.uid), str(root.uid))
+
+        assert owner_client.get(url + f"?depth={depth}").status_code == 400
+
+
+@pytest.mark.django_db
+class TestDirectorySpread:
+    def test_empty_folder_does_not_expand(self, drive, owner_client):
+
+        empty = build_folder(drive, "empty", width=0, levels=1)
+        url = build_object_endpoint(str(drive.uid), str(empty.uid))
+
+        response = owner_client.get(url)
+
+        assert response.status_code == 200
+        assert response.json()["content_count"] == 0
+        assert response.json()["directories"] is None
+
+    @pytest.mark.parametrize("folders, expands", [(1, False), (2, True)])
+    def test_expansion_follows_the_directory_share(
+        self, drive, owner_client, folders, expands
+    ):
+
+        root = build_folder(drive, "root", width=folders, levels=1)
+        for i in range(5 - folders):
+            root.content.add(
+                Object.objects.create(drive=drive, name=f"{i}.txt", path="/")
+            )
+
+        obj = Object.objects.with_directory_spread().get(pk=root.pk)
+        data = owner_client.get(
+            build_object_endpoint(str(drive.uid), str(root.uid))
+        ).json()
+
+        assert (obj.content_count, obj.directory_count) == (5, folders)
+        assert obj.expands_directories is expands
+        assert (data["directories"] is not None) is expands
+
+
+@pytest.mark.django_db
+class TestDriveDetail:
+    @pytest.mark.parametrize("width", [2, 6])
+    def test_detail_stays_within_its_query_budget(
+        self, drive, owner_client, user_factory, django_assert_max_num_queries, width
+    ):
+
+        drive.members.add(*user_factory.create_batch(5))
+        for i in range(width):
+            build_folder(drive, f"root-{i}", width=width, levels=2)
+        Object.objects.create(drive=drive, name="notes.txt", path="/notes.txt")
+
+        # plus the view's access check
+        budget = DriveDetailSerializer.DETAIL_QUERIES + 1
+        with django_assert_max_num_queries(budget):
+            response = owner_client.get(f"/api/v1/drives/{drive.uid}/")
+
+        data = response.json()
+        assert response.status_code == 200
+        assert len(data["members"]) == 3
+        assert len(data["storage_objects"]) == width + 1
+        assert [len(d["content"]) for d in data["directories"]] == [width] * width
+
+    def test_only_the_first_page_of_roots_is_loaded(self, drive, owner_client):
+
+        for i in range(3):
+            Object.objects.create(drive=drive, name=f"{i}.txt", path=f"/{i}.txt")
+        build_folder(drive, "root", width=1, levels=0)
+
+        with patch.object(DriveViewSet, "root_page_size", 2):
+            data = owner_client.get(f"/api/v1/drives/{drive.uid}/").json()
+
+        assert [obj["name"] for obj in data["storage_objects"]] == ["root", "2.txt"]
+        # one root in four is a folder: the spread counts every root, not the page
+        assert data["directories"] is None
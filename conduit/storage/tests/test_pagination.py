@@ -0,0 +1,147 @@
+from base64 import b64encode
+from unittest.mock import patch
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient
+from storage.models import Object
+from storage.views import ObjectViewSet
+
+from .test_storage import build_object_endpoint
+
+
+class PageOfTwenty(PageNumberPagination):
+    """What production configures as the default"""
+
+    page_size = 20
+
+
+@pytest.fixture
+def listed_drive(drive_factory, object_factory, user_factory):
+    """A drive with 25 root files, the first ten created in the same instant"""
+
+    drive = drive_factory.create(owner=user_factory.create())
+    for i in range(25):
+        object_factory.create(drive=drive, name=f"file-{i}.txt", is_directory=False)
+    Object.objects.filter(name__in=[f"file-{i}.txt" for i in range(10)]).update(
+        created_at=timezone.now()
+    )
+    return drive
+
+
+@pytest.mark.django_db
+class TestCursorPagination:
+    def walk(self, client, url):
+        pages = []
+        while url:
+            response = client.get(url)
+            assert response.status_code == 200
+            pages.append(response.json())
+            url = pages[-1]["next"]
+        return pages
+
+    def test_pages_cover_the_listing_once_in_order(self, listed_drive):
+
+        client = APIClient()
+        client.force_authenticate(listed_drive.owner)
+
+        pages = self.walk(
+            client, build_object_endpoint(str(listed_drive.uid)) + "?cursor&page_size=7"
+        )
+
+        uids = [obj["uid"] for page in pages for obj in page["results"]]
+        expected = Object.objects.filter(drive=listed_drive).order_by(
+            "-created_at", "-uid"
+        )
+        assert len(pages) == 4
+        assert uids == [str(uid) for uid in expected.values_list("uid", flat=True)]
+
+    def test_pages_do_not_count_the_listing(self, listed_drive):
+
+        client = APIClient()
+        client.force_authenticate(listed_drive.owner)
+        url = build_object_endpoint(str(listed_drive.uid)) + "?cursor&page_size=5"
+        last_page = self.walk(client, url)[-2]["next"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(last_page)
+
+        assert len(response.json()["results"]) == 5
+        assert not any("COUNT(" in q["sql"] for q in queries)
+        assert not any("OFFSET" in q["sql"] for q in queries)
+
+    def test_tied_rows_across_a_page_boundary_are_seeked_not_offset(self, listed_drive):
+
+        client = APIClient()
+        client.force_authenticate(listed_drive.owner)
+        # the ten rows sharing a created_at are the newest: pages of four
+        # split them twice
+        url = build_object_endpoint(str(listed_drive.uid)) + "?cursor&page_size=4"
+
+        with CaptureQueriesContext(connection) as queries:
+            pages = self.walk(client, url)
+
+        uids = [obj["uid"] for page in pages[:3] for obj in page["results"]]
+        tied = Object.objects.filter(
+            drive=listed_drive, name__in=[f"file-{i}.txt" for i in range(10)]
+        ).order_by("-uid")
+        assert uids[:10] == [str(uid) for uid in tied.values_list("uid", flat=True)]
+        assert not any("OFFSET" in q["sql"] for q in queries)
+
+    def test_previous_pages_walk_back_over_tied_rows(self, listed_drive):
+
+        client = APIClient()
+        client.force_authenticate(listed_drive.owner)
+        url = build_object_endpoint(str(listed_drive.uid)) + "?cursor&page_size=4"
+        forward = self.walk(client, url)
+
+        backward = [forward[-1]]
+        while backward[-1]["previous"]:
+            backward.append(client.get(backward[-1]["previous"]).json())
+
+        assert [page["results"] for page in reversed(backward)] == [
+            page["results"] for page in forward
+        ]
+
+    def test_a_malformed_cursor_is_not_found(self, listed_drive):
+
+        client = APIClient()
+        client.force_authenticate(listed_drive.owner)
+        cursor = b64encode(b"p=yesterday").decode()
+
+        response = client.get(
+            build_object_endpoint(str(listed_drive.uid)) + f"?cursor={cursor}"
+        )
+
+        assert response.status_code == 404
+
+    def test_listing_is_unpaginated_without_a_page_size(self, listed_drive):
+
+        client = APIClient()
+        client.force_authenticate(listed_drive.owner)
+
+        response = client.get(build_object_endpoint(str(listed_drive.uid)))
+
+        assert isinstance(response.json(), list)
+        assert len(response.json()) == 25
+
+    def test_listing_keeps_the_configured_pagination_without_a_cursor(
+        self, listed_drive
+    ):
+
+        client = APIClient()
+        client.force_authenticate(listed_drive.owner)
+
+        with patch.object(ObjectViewSet, "pagination_class", PageOfTwenty):
+            paged = client.get(build_object_endpoint(str(listed_drive.uid))).json()
+            keyset = client.get(
+                build_object_endpoint(str(listed_drive.uid)) + "?cursor"
+            ).json()
+
+        assert paged["count"] == 25
+        assert len(paged["results"]) == 20
+        assert "count" not in keyset
+        assert len(keyset["results"]) == 20
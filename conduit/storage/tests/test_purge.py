@@ -0,0 +1,173 @@
+from unittest.mock import patch
+
+import pytest
+from django.utils import timezone
+from rest_framework.test import APIClient
+from storage.models import Drive, Object
+from storage.tasks import (
+    PURGE_RETRIES,
+    PURGE_RETRY_DELAY,
+    PURGE_STRANDED,
+    purge_deleted_objects,
+    requeue_stranded_purges,
+)
+
+from .test_storage import build_object_endpoint
+
+
+@pytest.fixture
+def stored_tree(create_tree: Object, s3_handler) -> Object:
+    """create_tree with its files in the bucket, 10kb each"""
+
+    drive = create_tree.drive
+    for obj in Object.objects.filter(drive=drive, content__isnull=True):
+        s3_handler.client.put_object(
+            Bucket="test-bucket", Key=drive.name + obj.path, Body=b"x"
+        )
+    Object.objects.filter(drive=drive).update(size=10.0)
+    Object.objects.reconcile_sizes(drive.pk)
+    Drive.objects.filter(pk=drive.pk).update(used=50.0)
+    return create_tree
+
+
+def bucket_keys(handler):
+    response = handler.client.list_objects_v2(Bucket="test-bucket")
+    return sorted(obj["Key"] for obj in response.get("Contents", []))
+
+
+def delete(obj, capture) -> list:
+    client = APIClient()
+    client.force_authenticate(obj.drive.owner)
+    with capture() as callbacks:
+        response = client.delete(
+            build_object_endpoint(str(obj.drive.uid), str(obj.uid))
+        )
+    assert response.status_code == 204
+    return callbacks
+
+
+@pytest.mark.django_db
+class TestPurgeDeletedObjects:
+    def test_delete_hides_the_subtree_and_queues_the_purge(
+        self, stored_tree, django_capture_on_commit_callbacks
+    ):
+
+        kitchen = Object.objects.get(name="kitchen")
+
+        callbacks = delete(kitchen, django_capture_on_commit_callbacks)
+
+        hidden = Object.all_objects.filter(is_deleted=True)
+        assert sorted(hidden.values_list("name", flat=True)) == [
+            "cooker",
+            "fridge",
+            "fruits.json",
+            "kitchen",
+            "pot.png",
+        ]
+        assert not stored_tree.children.filter(name="kitchen").exists()
+        assert len(callbacks) == 2  # drive version bump and the purge
+
+    def test_purge_removes_keys_rows_and_space_in_batches(
+        self, stored_tree, s3_handler, django_capture_on_commit_callbacks
+    ):
+
+        living = Object.objects.get(name="living")
+        delete(living, django_capture_on_commit_callbacks)
+        delete_objects = s3_handler.client.delete_objects
+
+        with patch("storage.tasks.DELETE_BATCH_SIZE", 2), patch(
+            "abstract.apis.aws.handlers.DELETE_BATCH_SIZE", 2
+        ), patch.object(
+            s3_handler.client, "delete_objects", side_effect=delete_objects
+        ) as calls:
+            assert purge_deleted_objects(str(living.pk)) == 3
+
+        assert calls.call_count == 2
+        assert bucket_keys(s3_handler) == [
+            "test-drive/home/kitchen/cooker/pot.png",
+            "test-drive/home/kitchen/fridge/fruits.json",
+        ]
+        assert not Object.all_objects.filter(is_deleted=True).exists()
+        assert Drive.objects.get(pk=stored_tree.drive_id).used == 20
+
+    def test_failed_keys_keep_the_object_for_a_later_run(
+        self, stored_tree, s3_handler, django_capture_on_commit_callbacks
+    ):
+
+        table_top = Object.objects.get(name="table_top")
+        delete(table_top, django_capture_on_commit_callbacks)
+
+        with patch(
+            "abstract.apis.aws.handlers.S3AWSHandler.delete_objects",
+            return_value=["test-drive/home/living/table_top/remote.jpg"],
+        ), patch("storage.tasks.purge_deleted_objects.apply_async") as retry:
+            purge_deleted_objects(str(table_top.pk), attempt=2)
+
+        retry.assert_called_once_with(
+            (str(table_top.pk), 3), countdown=PURGE_RETRY_DELAY * 4
+        )
+        assert Object.all_objects.filter(pk=table_top.pk, is_deleted=True).exists()
+        assert Drive.objects.get(pk=stored_tree.drive_id).used == 50
+
+        assert purge_deleted_objects(str(table_top.pk)) == 1
+        assert not Object.all_objects.filter(pk=table_top.pk).exists()
+        assert Drive.objects.get(pk=stored_tree.drive_id).used == 30
+
+    def test_deleted_name_can_be_reused(
+        self, stored_tree, django_capture_on_commit_callbacks
+    ):
+
+        kitchen = Object.objects.get(name="kitchen")
+        delete(kitchen, django_capture_on_commit_callbacks)
+
+        fresh = Object.objects.create(drive=kitchen.drive, name="kitchen")
+        stored_tree.content.add(fresh)
+
+        assert Object.objects.get(name="kitchen").pk == fresh.pk
+
+    def test_a_folder_named_like_a_root_can_be_deleted(
+        self, stored_tree, django_capture_on_commit_callbacks
+    ):
+
+        kitchen = Object.objects.get(name="kitchen")
+        root = Object.objects.create(drive=kitchen.drive, name="kitchen")
+
+        delete(kitchen, django_capture_on_commit_callbacks)
+
+        hidden = Object.all_objects.get(pk=kitchen.pk)
+        assert hidden.is_deleted
+        assert hidden.parent_id is None and hidden.ancestors == []
+        assert Object.all_objects.get(name="pot.png").ancestors[0] == kitchen.pk
+        assert Object.objects.get(name="kitchen").pk == root.pk
+
+    def test_retries_stop_after_the_last_attempt(
+        self, stored_tree, django_capture_on_commit_callbacks
+    ):
+
+        table_top = Object.objects.get(name="table_top")
+        delete(table_top, django_capture_on_commit_callbacks)
+
+        with patch(
+            "abstract.apis.aws.handlers.S3AWSHandler.delete_objects",
+            return_value=["test-drive/home/living/table_top/remote.jpg"],
+        ), patch("storage.tasks.purge_deleted_objects.apply_async") as retry:
+            purge_deleted_objects(str(table_top.pk), attempt=PURGE_RETRIES)
+
+        retry.assert_not_called()
+
+    def test_stranded_deletes_are_queued_again(
+        self, stored_tree, django_capture_on_commit_callbacks
+    ):
+
+        kitchen = Object.objects.get(name="kitchen")
+        living = Object.objects.get(name="living")
+        delete(kitchen, django_capture_on_commit_callbacks)
+        delete(living, django_capture_on_commit_callbacks)
+        Object.all_objects.filter(pk=kitchen.pk).update(
+            updated_at=timezone.now() - PURGE_STRANDED
+        )
+
+        with patch("storage.tasks.purge_deleted_objects.delay") as purge:
+            assert requeue_stranded_purges() == 1
+
+        purge.assert_called_once_with(str(kitchen.pk))
@@ -0,0 +1,144 @@
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from share.file_tree import FilePath
+from share.tests.test_file_path import build_metadata
+from storage.cache import bump_drive_version, get_drive_version
+from storage.models import Object
+
+from .test_storage import build_object_endpoint
+
+
+def upload(drive, path, capture):
+    with capture(execute=True):
+        FilePath(build_metadata(drive, path)).parse_path()
+
+
+def object_tables(queries):
+    return [q["sql"] for q in queries if '"storage_object"' in q["sql"]]
+
+
+@pytest.mark.django_db
+class TestTreeCache:
+    def test_version_survives_eviction_without_going_back(
+        self, drive, django_capture_on_commit_callbacks
+    ):
+
+        first = get_drive_version(drive.pk)
+        with django_capture_on_commit_callbacks(execute=True):
+            bump_drive_version(drive.pk)
+        assert get_drive_version(drive.pk) == first + 1
+
+        cache.delete(f"drive:{drive.pk}:version")
+        assert get_drive_version(drive.pk) > first + 1
+
+    def test_unchanged_drive_detail_is_served_from_cache(
+        self, drive, owner_client, django_capture_on_commit_callbacks
+    ):
+
+        upload(drive, "docs/a.txt", django_capture_on_commit_callbacks)
+        url = f"/api/v1/drives/{drive.uid}/"
+        first = owner_client.get(url).json()
+
+        with CaptureQueriesContext(connection) as queries:
+            second = owner_client.get(url).json()
+
+        assert second == first
+        assert not object_tables(queries)
+
+    def test_upload_invalidates_drive_and_folder_detail(
+        self, drive, owner_client, django_capture_on_commit_callbacks
+    ):
+
+        upload(drive, "docs/a.txt", django_capture_on_commit_callbacks)
+        docs = Object.objects.get(drive=drive, name="docs")
+        folder_url = build_object_endpoint(str(drive.uid), str(docs.uid))
+        drive_url = f"/api/v1/drives/{drive.uid}/"
+        assert owner_client.get(folder_url).json()["content_count"] == 1
+        assert owner_client.get(drive_url).json()["used"] == 100
+
+        upload(drive, "docs/b.txt", django_capture_on_commit_callbacks)
+
+        assert owner_client.get(folder_url).json()["content_count"] == 2
+        assert owner_client.get(drive_url).json()["used"] == 200
+
+    def test_delete_invalidates_folder_detail(
+        self, drive, owner_client, django_capture_on_commit_callbacks
+    ):
+
+        upload(drive, "docs/a.txt", django_capture_on_commit_callbacks)
+        upload(drive, "docs/b.txt", django_capture_on_commit_callbacks)
+        docs = Object.objects.get(drive=drive, name="docs")
+        b = Object.objects.get(drive=drive, name="b.txt")
+        folder_url = build_object_endpoint(str(drive.uid), str(docs.uid))
+        assert owner_client.get(folder_url).json()["content_count"] == 2
+
+        with django_capture_on_commit_callbacks(execute=True):
+            owner_client.delete(build_object_endpoint(str(drive.uid), str(b.uid)))
+
+        assert owner_client.get(folder_url).json()["content_count"] == 1
+
+    def test_folder_detail_is_cached_per_depth(
+        self, drive, owner_client, django_capture_on_commit_callbacks
+    ):
+
+        upload(drive, "docs/notes/a.txt", django_capture_on_commit_callbacks)
+        docs = Object.objects.get(drive=drive, name="docs")
+        url = build_object_endpoint(str(drive.uid), str(docs.uid))
+
+        shallow = owner_client.get(url + "?depth=1").json()
+        deep = owner_client.get(url + "?depth=2").json()
+
+        assert shallow["directories"] is None
+        assert deep["directories"][0]["name"] == "notes"
+
+
+@pytest.mark.django_db
+class TestTreeETags:
+    def test_unchanged_poll_is_not_modified_without_queries(
+        self, drive, owner_client, django_capture_on_commit_callbacks
+    ):
+
+        upload(drive, "docs/a.txt", django_capture_on_commit_callbacks)
+        docs = Object.objects.get(drive=drive, name="docs")
+
+        for url in (
+            f"/api/v1/drives/{drive.uid}/",
+            build_object_endpoint(str(drive.uid), str(docs.uid)),
+        ):
+            etag = owner_client.get(url)["ETag"]
+            with CaptureQueriesContext(connection) as queries:
+                response = owner_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            assert response.status_code == 304
+            assert response["ETag"] == etag
+            assert not queries
+
+    def test_change_gets_a_new_etag(
+        self, drive, owner_client, django_capture_on_commit_callbacks
+    ):
+
+        upload(drive, "docs/a.txt", django_capture_on_commit_callbacks)
+        url = f"/api/v1/drives/{drive.uid}/"
+        etag = owner_client.get(url)["ETag"]
+
+        upload(drive, "docs/b.txt", django_capture_on_commit_callbacks)
+        response = owner_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    def test_etag_does_not_carry_over_to_another_user(
+        self, drive, owner_client, user_factory
+    ):
+
+        url = f"/api/v1/drives/{drive.uid}/"
+        etag = owner_client.get(url)["ETag"]
+        stranger = APIClient()
+        stranger.force_authenticate(user_factory.create())
+
+        response = stranger.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 404
@@ -0,0 +1,88 @@
+import pytest
+from rest_framework.test import APIClient
+from storage.models import Drive, Object
+from storage.tasks import purge_deleted_objects, verify_drive_usage
+
+from .test_storage import build_object_endpoint
+
+
+@pytest.fixture
+def sized_tree(create_tree: Object) -> Object:
+    """create_tree with 10kb files and folder sizes rolled up"""
+
+    drive = create_tree.drive
+    Object.objects.filter(drive=drive).update(size=10.0)
+    Object.objects.reconcile_sizes(drive.pk)
+    Drive.objects.filter(pk=drive.pk).update(used=50.0)
+    return create_tree
+
+
+@pytest.mark.django_db
+class TestDriveUsage:
+    def test_deleting_a_folder_frees_its_space(
+        self, sized_tree, s3_handler, django_capture_on_commit_callbacks
+    ):
+
+        drive = sized_tree.drive
+        living = Object.objects.get(name="living")
+        client = APIClient()
+        client.force_authenticate(drive.owner)
+
+        with django_capture_on_commit_callbacks():
+            response = client.delete(
+                build_object_endpoint(str(drive.uid), str(living.uid))
+            )
+
+        assert response.status_code == 204
+        assert Object.objects.get(name="home").size == 20
+        assert not Object.objects.filter(name__in=["living", "remote.jpg"]).exists()
+
+        purge_deleted_objects(str(living.pk))
+
+        drive.refresh_from_db()
+        assert drive.used == 20
+
+    def test_usage_drift_is_corrected(self, sized_tree, drive_factory):
+
+        drive = sized_tree.drive
+        untouched = drive_factory.create(owner=drive.owner, used=0.0)
+        Drive.objects.filter(pk=drive.pk).update(used=999.0)
+
+        assert verify_drive_usage() == 1
+
+        drive.refresh_from_db()
+        untouched.refresh_from_db()
+        assert drive.used == 50
+        assert untouched.used == 0
+
+    def test_empty_folders_do_not_count_as_files(self, sized_tree):
+
+        attic = Object.objects.create(
+            name="attic",
+            drive=sized_tree.drive,
+            path="/home/attic",
+            is_directory=True,
+            size=7.0,
+        )
+        sized_tree.content.add(attic)
+
+        assert Object.objects.reconcile_sizes(sized_tree.drive_id) == 1
+
+        assert Object.objects.get(name="home").size == 50
+        assert Object.objects.get(name="attic").size == 0
+
+    def test_empty_folders_do_not_count_as_drive_usage(self, sized_tree):
+
+        attic = Object.objects.create(
+            name="attic",
+            drive=sized_tree.drive,
+            path="/home/attic",
+            is_directory=True,
+            size=7.0,
+        )
+        sized_tree.content.add(attic)
+
+        assert verify_drive_usage() == 0
+
+        sized_tree.drive.refresh_from_db()
+        assert sized_tree.drive.used == 50
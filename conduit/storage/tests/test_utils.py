@@ -1,21 +1,76 @@
 from unittest.mock import patch
 
 import pytest
-from storage.models import fetch_all_folder_asset_from_db
+from django.db import connection
+from storage.models import Object
 
 
 @pytest.mark.django_db
 class TestUtils:
     @patch(
-        "storage.models.Object._get_object_download_url",
-        return_value="https://xyz.com",
+        "storage.models.S3AWSHandler.get_download_presigned_urls",
+        side_effect=lambda paths: ["https://xyz.com"] * len(paths),
     )
-    def test_fetch_all_folder_asset_from_db(
+    def test_folder_download_urls_cover_its_subtree_files(
         self, object_factory, create_tree, tree_paths
     ):
         # set up the factory with data
-        data = fetch_all_folder_asset_from_db(create_tree, [], "home")
+        create_tree.is_directory = True
+        data = create_tree.get_object_download_url()
 
         assert len(data) == len(tree_paths)
         for asset in data:
             assert asset["path"] in tree_paths
+
+    def test_subtree_files_are_fetched_in_one_query(
+        self, create_tree, tree_paths, django_assert_num_queries
+    ):
+
+        with django_assert_num_queries(1):
+            paths = [
+                obj.relative_path for obj in Object.objects.subtree_files(create_tree)
+            ]
+
+        assert sorted(paths) == sorted(tree_paths)
+
+    def test_streamed_subtree_files_are_not_sorted_first(self, create_tree):
+
+        chunks = list(Object.objects.iter_subtree_files(create_tree, chunk_size=2))
+        sql = Object.objects._subtree_files_sql("o.uid", ordered=False)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {sql}", [str(create_tree.pk)])
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+
+        assert "Sort" not in plan
+        assert len(sum(chunks, [])) == 5
+
+    def test_subtree_files_of_nested_folder_are_relative_to_it(self, create_tree):
+
+        kitchen = Object.objects.get(name="kitchen")
+        paths = {obj.relative_path for obj in Object.objects.subtree_files(kitchen)}
+
+        assert paths == {"kitchen/fridge/fruits.json", "kitchen/cooker/pot.png"}
+
+    def test_folder_urls_are_signed_with_one_shared_client(
+        self, s3_handler, create_tree, tree_paths
+    ):
+
+        create_tree.is_directory = True
+        with patch(
+            "abstract.apis.aws.services.AWSClientFactory.build_client"
+        ) as build_client:
+            data = create_tree.get_object_download_url()
+
+        build_client.assert_not_called()
+        assert len(data) == len(tree_paths)
+        for asset in data:
+            assert asset["path"].split("/", 1)[1] in asset["url"]
+
+    def test_batch_presigning_keeps_key_order(self, s3_handler):
+
+        paths = [f"drive/folder/file-{i}.txt" for i in range(10)]
+        urls = s3_handler.get_download_presigned_urls(paths)
+
+        assert len(urls) == len(paths)
+        for path, url in zip(paths, urls):
+            assert path in url
@@ -1,10 +1,14 @@
+from functools import partial
+from typing import Any, Callable, List
+
 from abstract.exceptions import BadRequestException
 from django.contrib.auth import get_user_model
 from django.contrib.auth.base_user import AbstractBaseUser
-from django.db import models
-from django.db.models import QuerySet
+from django.db import transaction
+from django.db.models import F, Prefetch, QuerySet
 from django.http import HttpResponse
 from django.http.request import HttpRequest
+from django.utils.http import parse_etags
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.mixins import (
@@ -15,15 +19,21 @@ from rest_framework.mixins import (
 )
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response, Serializer
-from rest_framework.status import HTTP_201_CREATED
+from rest_framework.status import HTTP_201_CREATED, HTTP_304_NOT_MODIFIED
 from rest_framework.views import Http404, status
 from rest_framework.viewsets import GenericViewSet
 
+from .cache import (
+    bump_drive_version,
+    get_breadcrumbs,
+    get_drive_version,
+    get_tree_etag,
+    get_tree_payload,
+)
 from .choices import DriveType
 from .models import Drive, Object
-from .permissions import IsDriveOwner, IsDriveOwnerOrMember
-
-# from share.serializers import DownloadPresignedURLSerializer
+from .pagination import ContentCursorPagination, CursorOptInMixin
+from .permissions import IsDriveOwner, IsDriveOwnerOrMember, forget_drive_members
 from .serializers import (
     AddDriveMemberSerializer,
     BaseDriveSerializer,
@@ -32,13 +42,44 @@ from .serializers import (
     DriveObjectSerializer,
     DriveSerializer,
     ObjectDetailSerializer,
-    ObjectPathSerializer,
 )
 
+# from share.serializers import DownloadPresignedURLSerializer
+from .tasks import purge_deleted_objects
+
 User: AbstractBaseUser = get_user_model()
 
+# how many folder levels a detail request may expand
+MAX_OBJECT_DEPTH = 5
+
+
+class TreeCacheMixin:
+    """Retrieve for payloads that only change with their drive's version"""
+
+    def get_tree_response(
+        self,
+        drive_id: str,
+        key: str,
+        check: Callable[[], Any],
+        build: Callable[[], Any],
+    ) -> HttpResponse:
+        """Answers `If-None-Match` from the drive version alone, before any
+        database work; otherwise runs the access `check` and serves the
+        cached (or freshly built) payload with its ETag."""
+
+        version = get_drive_version(drive_id)
+        etag = get_tree_etag(drive_id, version, key, self.request.user.pk)
+        if etag in parse_etags(self.request.headers.get("If-None-Match", "")):
+            return Response(status=HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        check()
+        data = get_tree_payload(drive_id, version, key, build)
+        return Response(data, headers={"ETag": etag})
+
 
 class DriveViewSet(
+    CursorOptInMixin,
+    TreeCacheMixin,
     CreateModelMixin,
     RetrieveModelMixin,
     ListModelMixin,
@@ -46,14 +87,12 @@ class DriveViewSet(
     GenericViewSet,
 ):
 
-    queryset = (
-        Drive.objects.prefetch_related("members")
-        .select_related("owner")
-        .filter(is_active=True)
-    )
+    queryset = Drive.objects.select_related("owner").filter(is_active=True)
     serializer_class = DriveSerializer
     permission_classes = [IsAuthenticated, IsDriveOwner]
     lookup_field = "uid"
+    # the rest of the top level is paged through the object listing
+    root_page_size = ContentCursorPagination.page_size
 
     def get_serializer_class(self) -> Serializer:
         if self.action == "retrieve":
@@ -61,12 +100,44 @@ class DriveViewSet(
         return super().get_serializer_class()
 
     def get_queryset(self) -> QuerySet:
-        return (
-            self.queryset.filter(
-                models.Q(owner=self.request.user) | models.Q(members=self.request.user)
-            )
-            .prefetch_related("storage_object")
-            .distinct()
+        qs = self.queryset.accessible_to(self.request.user)
+        if self.action == "retrieve":
+            return qs.with_root_spread().prefetch_related(*self.get_detail_prefetches())
+        return qs
+
+    def get_detail_prefetches(self) -> List[Prefetch]:
+        """Everything DriveDetailSerializer shows, one query per lookup:
+        the first three members, and the first `root_page_size` root
+        objects with the first page of each root folder's content."""
+
+        return [
+            Prefetch(
+                "members", queryset=User.objects.all()[:3], to_attr="member_preview"
+            ),
+            Prefetch(
+                "storage_object",
+                queryset=Object.objects.filter(parent__isnull=True)
+                .with_content()
+                .order_by("-created_at", "-uid")[: self.root_page_size],
+                to_attr="roots",
+            ),
+        ]
+
+    def retrieve(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Drive detail, rendered once per drive version"""
+
+        uid = kwargs.get(self.lookup_field)
+
+        def check():
+            drives = self.queryset.accessible_to(self.request.user)
+            if not drives.filter(uid=uid).exists():
+                raise Http404("Drive Not Found")
+
+        return self.get_tree_response(
+            uid,
+            "detail",
+            check,
+            lambda: self.get_serializer(self.get_object()).data,
         )
 
     def create(self, request: HttpRequest, **kwargs) -> HttpResponse:
@@ -84,13 +155,19 @@ class DriveViewSet(
         if instance.type == DriveType.PERSONAL:
             raise BadRequestException("You cannot delete your drive")
         instance.is_active = False
-        instance.save()
+        instance.save(update_fields=["is_active"])
+        bump_drive_version(instance.pk)
 
 
 class ObjectViewSet(
-    RetrieveModelMixin, ListModelMixin, DestroyModelMixin, GenericViewSet
+    CursorOptInMixin,
+    TreeCacheMixin,
+    RetrieveModelMixin,
+    ListModelMixin,
+    DestroyModelMixin,
+    GenericViewSet,
 ):
-    queryset = Object.objects.select_related("drive").prefetch_related("content")
+    queryset = Object.objects.select_related("drive")
     serializer_class = DriveObjectSerializer
     permission_classes = [IsAuthenticated, IsDriveOwnerOrMember, IsDriveOwner]
     lookup_field = "uid"
@@ -100,34 +177,84 @@ class ObjectViewSet(
             return ObjectDetailSerializer
         return super().get_serializer_class()
 
-    def get_queryset(self) -> QuerySet:
+    def get_drive(self) -> Drive:
 
-        drive_uid = self.kwargs.get("drives_uid")
-        drive = get_object_or_404(
-            Drive.objects.select_related("owner").prefetch_related("members"),
-            uid=drive_uid,
-        )
-        self.check_object_permissions(self.request, drive)
+        if not hasattr(self, "_drive"):
+            self._drive = get_object_or_404(
+                Drive.objects.select_related("owner"),
+                uid=self.kwargs.get("drives_uid"),
+            )
+            self.check_object_permissions(self.request, self._drive)
+        return self._drive
 
-        qs = self.queryset.filter(drive__uid=drive_uid)
+    def get_queryset(self) -> QuerySet:
+
+        qs = self.queryset.filter(drive=self.get_drive())
         if self.action == "list":
-            return qs.filter(in_directory__isnull=True)
+            return qs.filter(parent__isnull=True)
+        if self.action == "retrieve":
+            page_size = ContentCursorPagination().get_page_size(self.request)
+            return qs.with_content(self.get_depth(), page_size)
         return qs
 
     def get_object(self) -> Object:
         try:
-            return (
-                self.get_queryset()
-                .prefetch_related("content")
-                .get(uid=self.kwargs.get(self.lookup_field))
-            )
+            return self.get_queryset().get(uid=self.kwargs.get(self.lookup_field))
         except Object.DoesNotExist:
             raise Http404("Storage object Not Found")
 
+    def get_depth(self) -> int:
+        """Folder levels to expand on retrieve, from `?depth` (defaults to 2)"""
+
+        depth = self.request.query_params.get("depth", "2")
+        if not depth.isdigit() or not 1 <= int(depth) <= MAX_OBJECT_DEPTH:
+            raise BadRequestException(
+                f"depth must be a number between 1 and {MAX_OBJECT_DEPTH}"
+            )
+        return int(depth)
+
+    def retrieve(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Folder detail, rendered once per drive version, depth and page size"""
+
+        key = "object:{}:depth:{}:{}".format(
+            kwargs.get(self.lookup_field),
+            self.get_depth(),
+            ContentCursorPagination().get_page_size(request),
+        )
+        return self.get_tree_response(
+            kwargs.get("drives_uid"),
+            key,
+            self.get_drive,
+            lambda: self.get_serializer(self.get_object()).data,
+        )
+
+    @transaction.atomic
+    def perform_destroy(self, instance: Object):
+        """Hides the object with everything under it straight away; its files
+        are purged from S3 and the drive's space freed in the background"""
+
+        size = instance.size or 0.0
+        Object.objects.filter(pk__in=instance.ancestors).update(size=F("size") - size)
+        Object.objects.mark_deleted(instance)
+        bump_drive_version(instance.drive_id)
+        transaction.on_commit(partial(purge_deleted_objects.delay, str(instance.pk)))
+
+    @action(methods=["GET"], detail=True, url_path="get-content")
+    def get_content(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Pages through everything directly inside a folder"""
+
+        folder = self.get_object()
+        paginator = ContentCursorPagination()
+        page = paginator.paginate_queryset(
+            Object.objects.filter(parent=folder), request, view=self
+        )
+        return paginator.get_paginated_response(
+            DriveObjectSerializer(page, many=True).data
+        )
+
     @action(methods=["GET"], detail=True, url_path="get_path_detail")
     def get_path_detail(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
         folder = None
-        object_nodes = []
 
         try:
             folder = self.get_queryset().get(pk=kwargs.get("uid"))
@@ -135,10 +262,7 @@ class ObjectViewSet(
             pass
 
         if folder:
-            object_nodes = folder.parse_path()
-            serializer = ObjectPathSerializer(object_nodes, many=True)
-
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(get_breadcrumbs(folder), status=status.HTTP_200_OK)
 
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
@@ -158,13 +282,13 @@ class DriveMemberView(
 
     def get_drive(self) -> Drive:
 
-        drive_uid = self.kwargs.get("drives_uid")
-        drive = get_object_or_404(
-            Drive.objects.select_related("owner").prefetch_related("members"),
-            uid=drive_uid,
-        )
-        self.check_object_permissions(self.request, drive)
-        return drive
+        if not hasattr(self, "_drive"):
+            self._drive = get_object_or_404(
+                Drive.objects.select_related("owner"),
+                uid=self.kwargs.get("drives_uid"),
+            )
+            self.check_object_permissions(self.request, self._drive)
+        return self._drive
 
     def get_queryset(self) -> QuerySet:
 
@@ -185,6 +309,7 @@ class DriveMemberView(
         serializer = AddDriveMemberSerializer(drive, data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_drive_version(drive.pk)
         return Response(status=status.HTTP_200_OK)
 
     def perform_destroy(self, instance: AbstractBaseUser):
@@ -192,3 +317,5 @@ class DriveMemberView(
 
         drive = self.get_drive()
         drive.members.remove(instance)
+        forget_drive_members(drive.pk, [instance.pk])
+        bump_drive_version(drive.pk)